@@ -0,0 +1,185 @@
+import json
+import time
+import traceback
+import uuid
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.db import connections
+from django_scopes import scope, scopes_disabled
+
+from pretix.base.models import Organizer
+from pretix_migrate_from_xing_events.importer.client import XINGEventsAPIClient
+from pretix_migrate_from_xing_events.importer.locks import COMMAND_LEASE_PREFIX, release_lease
+from pretix_migrate_from_xing_events.importer.main import XINGEventsImporter
+from pretix_migrate_from_xing_events.importer.snapshot import XINGEventsSnapshotSource
+from pretix_migrate_from_xing_events.tasks import lease_renewer, reserve_events
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def read_manifest(fileobj):
+    """
+    Reads a JSON manifest listing the organizers to migrate, e.g.::
+
+        [
+            {"organizer": "demo", "apikey": "…", "events": [1234, 5678], "with_orders": false},
+            {"organizer": "other", "snapshot": "/data/other.jsonl.gz", "max_jobs": 2}
+        ]
+
+    ``events`` limits the import to the given XING event IDs, ``exclude_events`` skips events. ``with_vouchers``
+    and ``with_orders`` default to true, ``max_jobs`` overrides the per-organizer concurrency limit.
+    """
+    try:
+        entries = json.load(fileobj)
+    except ValueError as e:
+        raise ManifestError(f'Manifest is not valid JSON: {e}')
+    if not isinstance(entries, list):
+        raise ManifestError('Manifest needs to be a list of organizers.')
+    for i, entry in enumerate(entries):
+        if not entry.get('organizer'):
+            raise ManifestError(f'Entry {i} does not contain an organizer slug.')
+        if not entry.get('apikey') and not entry.get('snapshot'):
+            raise ManifestError(f'Entry {i} contains neither an API key nor a snapshot.')
+        if 'max_jobs' in entry and (not isinstance(entry['max_jobs'], int) or entry['max_jobs'] < 1):
+            raise ManifestError(f'Entry {i} needs to allow at least one job.')
+        entry.setdefault('with_vouchers', True)
+        entry.setdefault('with_orders', True)
+    return entries
+
+
+def _client(entry):
+    if entry.get('snapshot'):
+        return XINGEventsSnapshotSource(entry['snapshot'])
+    return XINGEventsAPIClient(apikey=entry['apikey'])
+
+
+def _run_job(entry, event_id):
+    result = {
+        'organizer': entry['organizer'],
+        'event_id': event_id,
+        'started': time.time(),
+    }
+    t = time.monotonic()
+    client = None
+    owner = f'{COMMAND_LEASE_PREFIX}{uuid.uuid4().hex}'
+    try:
+        with scopes_disabled():
+            organizer = Organizer.objects.get(slug=entry['organizer'])
+        # Without a snapshot, the importer creates its API client with the same validator store as imports started
+        # elsewhere, so re-imports send conditional requests
+        importer = XINGEventsImporter(
+            apikey=entry.get('apikey'), organizer=organizer,
+            client=XINGEventsSnapshotSource(entry['snapshot']) if entry.get('snapshot') else None,
+        )
+        client = importer.client
+        # Events that are being imported by a task or another command are left alone
+        own, running = reserve_events(organizer, [event_id], owner)
+        if running:
+            result['outcome'] = 'locked'
+            result['error'] = f'Already being imported by {running[event_id]}'
+        else:
+            try:
+                with scope(organizer=organizer):
+                    event = importer.import_event(
+                        event_id, with_vouchers=entry['with_vouchers'], with_orders=entry['with_orders'],
+                        progress_callback=lease_renewer(organizer, [event_id], owner),
+                    )
+            finally:
+                release_lease(organizer, event_id, owner)
+            result['outcome'] = 'success'
+            result['slug'] = event.slug
+    except Exception as e:
+        result['outcome'] = 'error'
+        result['error'] = str(e)
+        result['traceback'] = traceback.format_exc()
+    finally:
+        if client:
+            client.close()
+        connections.close_all()
+    result['duration'] = time.monotonic() - t
+    result['api_calls'] = client.request_count if client else 0
+    result['api_time'] = client.request_time if client else 0.0
+    return result
+
+
+def collect_jobs(entries):
+    """
+    Returns the events to import for all manifest entries, and the results of the entries whose events could not
+    be listed, e.g. because of an invalid API key.
+    """
+    jobs = []
+    failed = []
+    for entry in entries:
+        try:
+            event_ids = entry.get('events')
+            if not event_ids:
+                client = _client(entry)
+                try:
+                    event_ids = client.get_event_ids()
+                finally:
+                    client.close()
+        except Exception as e:
+            failed.append({
+                'organizer': entry['organizer'],
+                'event_id': None,
+                'outcome': 'error',
+                'error': str(e),
+                'traceback': traceback.format_exc(),
+            })
+            continue
+        exclude = set(entry.get('exclude_events') or [])
+        jobs += [(entry, event_id) for event_id in event_ids if event_id not in exclude]
+    return jobs, failed
+
+
+def run_batch(entries, jobs=1, per_organizer_jobs=1, log=None):
+    """
+    Imports all events listed in the manifest entries in a pool of ``jobs`` processes, with at most
+    ``per_organizer_jobs`` events of the same organizer at the same time. Returns a summary of all jobs.
+    """
+    if jobs < 1 or per_organizer_jobs < 1:
+        raise ValueError('At least one job needs to run at a time.')
+    started = time.time()
+    t = time.monotonic()
+    pending, results = collect_jobs(entries)
+    running = {}
+    per_organizer = Counter()
+    if log:
+        for r in results:
+            log(r)
+
+    # Forked processes must not share our database connection
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            for job in list(pending):
+                if len(running) >= jobs:
+                    break
+                entry, event_id = job
+                if per_organizer[entry['organizer']] >= entry.get('max_jobs', per_organizer_jobs):
+                    continue
+                pending.remove(job)
+                per_organizer[entry['organizer']] += 1
+                running[executor.submit(_run_job, entry, event_id)] = job
+
+            done, __ = wait(running, return_when=FIRST_COMPLETED)
+            for f in done:
+                entry, event_id = running.pop(f)
+                per_organizer[entry['organizer']] -= 1
+                try:
+                    r = f.result()
+                except Exception as e:
+                    r = {'organizer': entry['organizer'], 'event_id': event_id, 'outcome': 'error', 'error': str(e)}
+                results.append(r)
+                if log:
+                    log(r)
+
+    return {
+        'started': started,
+        'duration': time.monotonic() - t,
+        'outcomes': dict(Counter(r['outcome'] for r in results)),
+        'jobs': results,
+    }
@@ -1,7 +1,19 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from urllib.parse import urljoin
 
 import requests
 
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:  # pragma: no cover
+    ijson = None
+
+SCALAR_EVENTS = ('null', 'boolean', 'integer', 'double', 'number', 'string')
+
 
 class APIError(IOError):
     pass
@@ -9,27 +21,191 @@ class APIError(IOError):
 
 class XINGEventsAPIClient:
     base_url = 'https://www.xing-events.com/api/'
+    # Sources that do not read from an HTTP response can not stream, see iter_list
+    streaming = True
+    # Seconds to wait for a connection and between two bytes of a response, unless a request sets its own
+    timeout = (10, 60)
 
-    def __init__(self, apikey):
+    def __init__(self, apikey, validator_store=None, memo_size=2048):
         self.apikey = apikey
+        self.request_count = 0
+        self.request_time = 0.0
+        self.validator_store = validator_store
+        self.memo_size = memo_size
+        self._pending_validators = {}
+        self._memo = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
 
     def _headers(self):
         return {
             'Authorization': f'ApiKey {self.apikey}'
         }
 
-    def _get(self, path, **kwargs):
+    def _request(self, path, headers=None, **kwargs):
+        t = time.monotonic()
+        kwargs.setdefault('timeout', self.timeout)
         r = requests.get(
             urljoin(self.base_url, path),
-            headers=self._headers(),
+            headers={**self._headers(), **(headers or {})},
             **kwargs
         )
+        with self._lock:
+            self.request_count += 1
+            self.request_time += time.monotonic() - t
+        return r
+
+    def _parse(self, r, path):
         r.raise_for_status()
         d = r.json()
         if not d['success']:
             raise APIError(f'API returned success=false for {path}')
         return d
 
+    def _get(self, path, **kwargs):
+        return self._parse(self._request(path, **kwargs), path)
+
+    def iter_list(self, path, key, meta=None):
+        """
+        Yields the items of the list ``key`` of the response, e.g. payment IDs or voucher codes, while the response
+        is still being received, so huge lists are processed with constant memory. The other top-level values of
+        the response, e.g. ``currentPage`` and ``lastPage``, are put into ``meta`` once the list has been consumed.
+
+        Falls back to parsing the whole response if ``ijson`` is not installed.
+        """
+        meta = {} if meta is None else meta
+        if ijson is None or not self.streaming:
+            d = self._get(path)
+            meta.update({k: v for k, v in d.items() if k != key})
+            yield from d[key]
+            return
+
+        with self._request(path, stream=True) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            item_prefix = f'{key}.item'
+            builder = None
+            for prefix, event, value in ijson.parse(r.raw, use_float=True):
+                if builder is not None:
+                    builder.event(event, value)
+                    if prefix == item_prefix and event in ('end_map', 'end_array'):
+                        yield builder.value
+                        builder = None
+                elif prefix == item_prefix:
+                    if event in ('start_map', 'start_array'):
+                        builder = ObjectBuilder()
+                        builder.event(event, value)
+                    else:
+                        yield value
+                elif '.' not in prefix and prefix != key and event in SCALAR_EVENTS:
+                    meta[prefix] = value
+        if not meta.get('success'):
+            raise APIError(f'API returned success=false for {path}')
+
+    def _get_conditional(self, path, **kwargs):
+        """
+        Like ``_get``, but sends the validators of a previous response for the same URL. Returns the payload and
+        whether it changed since then.
+
+        New validators are only stored once ``commit_validators`` is called, so they do not outlive an import
+        that has been rolled back.
+        """
+        if self.validator_store is None:
+            return self._get(path, **kwargs), True
+
+        url = urljoin(self.base_url, path)
+        cached = self.validator_store.get(url)
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        r = self._request(path, headers=headers, **kwargs)
+        if r.status_code == 304 and cached:
+            return cached['data'], False
+
+        d = self._parse(r, path)
+        if r.headers.get('ETag') or r.headers.get('Last-Modified'):
+            with self._lock:
+                self._pending_validators[url] = {
+                    'etag': r.headers.get('ETag'),
+                    'last_modified': r.headers.get('Last-Modified'),
+                    'data': d,
+                }
+        return d, True
+
+    def _memoized(self, key, fetch):
+        """
+        Returns the result of ``fetch()``, but calls it only once for the same key while the result is in the
+        bounded LRU memo. Concurrent callers asking for the same key wait for the first caller's request instead
+        of sending their own.
+        """
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+            flight = self._in_flight.get(key)
+            if flight is None:
+                flight = self._in_flight[key] = Future()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            return flight.result()
+
+        try:
+            result = fetch()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            flight.set_exception(e)
+            raise
+
+        with self._lock:
+            self._memo[key] = result
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+            del self._in_flight[key]
+        flight.set_result(result)
+        return result
+
+    def _get_memoized(self, path, **kwargs):
+        """
+        Like ``_get``, for entities that are requested repeatedly during a run. Callers must not modify the
+        returned payload.
+        """
+        return self._memoized(path, lambda: self._get(path, **kwargs))
+
+    def _get_conditional_memoized(self, path, **kwargs):
+        return self._memoized(('conditional', path), lambda: self._get_conditional(path, **kwargs))
+
+    def commit_validators(self):
+        with self._lock:
+            pending, self._pending_validators = self._pending_validators, {}
+        for url, value in pending.items():
+            self.validator_store.set(url, value)
+
+    def discard_validators(self):
+        with self._lock:
+            self._pending_validators = {}
+
+    @property
+    def mean_latency(self):
+        if not self.request_count:
+            return None
+        return self.request_time / self.request_count
+
+    def close(self):
+        # Other sources, e.g. snapshot files, hold resources that need to be released
+        pass
+
+    def get_file(self, url):
+        r = requests.get(url, timeout=self.timeout)
+        r.raise_for_status()
+        return r.content
+
     def get_event_ids(self):
         d = self._get('event/find')
         return d['ids']
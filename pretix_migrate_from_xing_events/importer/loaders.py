@@ -0,0 +1,132 @@
+"""
+Backends that write many rows of the same model at once, used for promotion codes and answers.
+
+The default backend uses ``bulk_create``. On PostgreSQL, the ``copy`` backend streams the rows into a temporary
+staging table with ``COPY`` and merges them into the real table with a single ``INSERT … SELECT``, which skips the
+construction of model instances and the binding of query parameters for every row. It is enabled with::
+
+    [pretix_migrate_from_xing_events]
+    loader=copy
+"""
+import datetime
+import io
+import json
+
+from django.conf import settings
+from django.db import connection, models, transaction
+
+
+def _copy_text(value):
+    # Text format of COPY, see https://www.postgresql.org/docs/current/sql-copy.html
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class BulkLoader:
+    """
+    Creates rows given as dictionaries of field names and values. If ``unique_fields`` are given, rows that
+    already exist are updated in ``update_fields`` instead.
+    """
+
+    def __init__(self, model, unique_fields=(), update_fields=()):
+        self.model = model
+        self.unique_fields = list(unique_fields)
+        self.update_fields = list(update_fields)
+
+    def load(self, rows):
+        if not rows:
+            return
+        objs = [self.model(**row) for row in rows]
+        if self.unique_fields:
+            self.model.objects.bulk_create(
+                objs, update_conflicts=True, unique_fields=self.unique_fields, update_fields=self.update_fields,
+            )
+        else:
+            self.model.objects.bulk_create(objs)
+
+
+class CopyLoader(BulkLoader):
+    """
+    Same as ``BulkLoader``, but uses ``COPY`` and a set-based upsert. PostgreSQL only.
+    """
+
+    def __init__(self, model, unique_fields=(), update_fields=()):
+        super().__init__(model, unique_fields, update_fields)
+        # Values of all columns the rows do not set are taken from an unsaved instance once, so defaults and
+        # auto_now fields are filled in like the ORM would do.
+        template = model()
+        self.defaults = {
+            f.name: f.pre_save(template, add=True)
+            for f in model._meta.concrete_fields
+            if not f.primary_key
+        }
+
+    def _field(self, name):
+        return self.model._meta.get_field(name)
+
+    def _db_value(self, field, value):
+        if isinstance(value, models.Model):
+            return value.pk
+        if isinstance(value, (dict, list)):
+            return value
+        return field.get_db_prep_save(value, connection)
+
+    def load(self, rows):
+        if not rows:
+            return
+        qn = connection.ops.quote_name
+        fields = [self._field(name) for name in self.defaults]
+        table = qn(self.model._meta.db_table)
+        staging = qn(f'xing_staging_{self.model._meta.db_table}')
+        columns = ', '.join(qn(f.column) for f in fields)
+
+        buf = io.StringIO()
+        for row in rows:
+            row = {**self.defaults, **row}
+            buf.write('\t'.join(_copy_text(self._db_value(f, row[f.name])) for f in fields))
+            buf.write('\n')
+        buf.seek(0)
+
+        conflict = ''
+        if self.unique_fields:
+            conflict = 'ON CONFLICT ({}) DO UPDATE SET {}'.format(
+                ', '.join(qn(self._field(name).column) for name in self.unique_fields),
+                ', '.join(
+                    '{col} = EXCLUDED.{col}'.format(col=qn(self._field(name).column)) for name in self.update_fields
+                ),
+            )
+
+        # The staging table only lives until the end of the transaction
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA')
+            copy_sql = f'COPY {staging} ({columns}) FROM STDIN'
+            raw = cursor.cursor
+            if hasattr(raw, 'copy_expert'):
+                # psycopg2
+                raw.copy_expert(copy_sql, buf)
+            else:
+                # psycopg 3
+                with raw.copy(copy_sql) as copy:
+                    for line in buf:
+                        copy.write(line)
+            cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} {conflict}')
+            cursor.execute(f'DROP TABLE {staging}')
+
+
+def get_loader(model, unique_fields=(), update_fields=(), backend=None):
+    """
+    Returns the configured loader for a model. The ``copy`` backend falls back to the ORM on other databases than
+    PostgreSQL.
+    """
+    if backend is None:
+        backend = settings.CONFIG_FILE.get('pretix_migrate_from_xing_events', 'loader', fallback='orm')
+    if backend == 'copy' and connection.vendor == 'postgresql':
+        return CopyLoader(model, unique_fields, update_fields)
+    return BulkLoader(model, unique_fields, update_fields)
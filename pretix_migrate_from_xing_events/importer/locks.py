@@ -0,0 +1,134 @@
+import hashlib
+import logging
+from datetime import timedelta
+from functools import lru_cache
+
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.utils.crypto import get_random_string
+from django.utils.timezone import now
+
+from pretix_migrate_from_xing_events.models import ImportLease
+
+logger = logging.getLogger(__name__)
+
+
+def _key_id(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+def lock_keys(keys):
+    """
+    Takes transaction-level advisory locks for all given string keys, so parallel imports (e.g. shards of the
+    same event) cannot create the same order code or pseudonymization ID at the same time. Locks are taken in a
+    stable order to rule out deadlocks. Other databases do not support concurrent writers in a meaningful way,
+    so this is a no-op for them.
+    """
+    if connection.vendor != 'postgresql' or not keys:
+        return
+    ids = sorted({_key_id(k) for k in keys})
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(k) FROM unnest(%s::bigint[]) AS k', [ids])
+
+
+@lru_cache(maxsize=None)
+def cache_holds_values():
+    """
+    Whether the cache actually stores values. Installations without a cache server use a dummy cache, on which
+    counters and leases can not work.
+    """
+    key = f'xing_import_probe_{get_random_string(12)}'
+    cache.set(key, 1, 60)
+    held = cache.get(key) == 1
+    cache.delete(key)
+    if not held:
+        logger.warning('The cache does not store values, leases of XING imports are kept in the database.')
+    return held
+
+
+# Running imports renew their lease after every batch of payments. Imports that die without releasing their lease
+# block new imports of the same event for at most this long.
+LEASE_SECONDS = 3600 * 2
+
+# Leases of imports started on the command line instead of a Celery task
+COMMAND_LEASE_PREFIX = 'command-'
+
+
+def _lease_key(organizer, event_id):
+    return f'xing_import_lease_{organizer.pk}_{event_id}'
+
+
+def _db_leases(organizer, event_id):
+    return ImportLease.objects.filter(organizer=organizer, event_id=event_id)
+
+
+def _db_acquire_lease(organizer, event_id, owner, timeout):
+    while True:
+        _db_leases(organizer, event_id).filter(expires__lt=now()).delete()
+        try:
+            with transaction.atomic():
+                ImportLease.objects.create(
+                    organizer=organizer, event_id=event_id, owner=owner, expires=now() + timedelta(seconds=timeout)
+                )
+            return owner
+        except IntegrityError:
+            holder = _db_get_lease(organizer, event_id)
+            if holder is not None:
+                return holder
+            # The lease expired or was released in the meantime
+
+
+def _db_get_lease(organizer, event_id):
+    return _db_leases(organizer, event_id).filter(expires__gte=now()).values_list('owner', flat=True).first()
+
+
+def acquire_lease(organizer, event_id, owner, timeout=LEASE_SECONDS):
+    """
+    Reserves the import of a XING event for ``owner``, e.g. a task ID. Returns the owner of the lease, which is
+    ``owner`` itself if the lease was acquired and the import that is already running otherwise.
+
+    Leases are kept in the cache, or in the database if the cache does not store values.
+    """
+    if not cache_holds_values():
+        return _db_acquire_lease(organizer, event_id, owner, timeout)
+    key = _lease_key(organizer, event_id)
+    while True:
+        if cache.add(key, owner, timeout):
+            return owner
+        holder = cache.get(key)
+        if holder is not None:
+            return holder
+        # The lease expired between add() and get()
+
+
+def renew_lease(organizer, event_id, owner, timeout=LEASE_SECONDS):
+    """
+    Extends the lease of ``owner`` by ``timeout`` seconds, or acquires it again if it expired. Returns ``False`` if
+    another import acquired the lease in the meantime.
+    """
+    if not cache_holds_values() and connection.in_atomic_block:
+        # Other imports would only see the new expiry once the import is committed, and would wait for the row
+        # lock until then. The lease is renewed once the import is outside of its transaction again.
+        return _db_get_lease(organizer, event_id) in (owner, None)
+    if acquire_lease(organizer, event_id, owner, timeout) != owner:
+        return False
+    if cache_holds_values():
+        cache.touch(_lease_key(organizer, event_id), timeout)
+    else:
+        _db_leases(organizer, event_id).filter(owner=owner).update(expires=now() + timedelta(seconds=timeout))
+    return True
+
+
+def get_lease(organizer, event_id):
+    if not cache_holds_values():
+        return _db_get_lease(organizer, event_id)
+    return cache.get(_lease_key(organizer, event_id))
+
+
+def release_lease(organizer, event_id, owner):
+    if not cache_holds_values():
+        _db_leases(organizer, event_id).filter(owner=owner).delete()
+        return
+    key = _lease_key(organizer, event_id)
+    if cache.get(key) == owner:
+        cache.delete(key)
@@ -1,13 +1,14 @@
 import datetime
 import json
+import logging
 import os
+import traceback
 from decimal import Decimal
-from itertools import chain
+from itertools import chain, islice
 from urllib.parse import urljoin, urlparse
 
 import bleach
 import pytz
-import requests
 from dateutil.parser import parse
 from django.conf import settings
 from django.core.files.base import ContentFile
@@ -21,22 +22,120 @@ from i18nfield.strings import LazyI18nString
 from pretix.base.channels import get_all_sales_channels
 from pretix.base.models import Event, ItemMetaValue, Item, ItemVariation, Question, Order, OrderPayment, OrderPosition, \
     Checkin, QuestionAnswer, InvoiceAddress, OrderFee, Voucher, Quota
+from pretix.base.services.quotas import QuotaAvailability
 from pretix.base.settings import LazyI18nStringList
 from pretix.base.templatetags.rich_text import ALLOWED_TAGS, ALLOWED_ATTRIBUTES, ALLOWED_PROTOCOLS
 from pretix_migrate_from_xing_events.importer.client import XINGEventsAPIClient
+from pretix_migrate_from_xing_events.importer.loaders import get_loader
+from pretix_migrate_from_xing_events.importer.locks import lock_keys
+from pretix_migrate_from_xing_events.importer.payloads import (
+    Participant, Payment, PaymentBundle, Product, ProductDefinition, SchemaError, Ticket, TicketBundle,
+)
+from pretix_migrate_from_xing_events.importer.plan import ImportPlan
+from pretix_migrate_from_xing_events.importer.shards import PaymentImportResult
+from pretix_migrate_from_xing_events.importer.stages import StageScheduler
+from pretix_migrate_from_xing_events.importer.validators import CacheValidatorStore
+from pretix_migrate_from_xing_events.models import FailedPayment
+
+logger = logging.getLogger(__name__)
+
+# Number of payments whose tickets are counted to extrapolate the number of tickets in a plan
+PLAN_SAMPLE_SIZE = 10
+
+# Number of payments fetched from the API before they are written to the database together
+PAYMENT_BATCH_SIZE = 100
+
+# Number of promotion codes written to the database together
+VOUCHER_BATCH_SIZE = 500
+
+VOUCHER_FIELDS = (
+    'redeemed', 'tag', 'item', 'quota', 'max_usages', 'valid_until', 'price_mode', 'value', 'show_hidden_items',
+)
+
+# Errors caused by the content of a single payment, as opposed to e.g. the API being unreachable
+PAYLOAD_ERRORS = (SchemaError, KeyError, TypeError, ValueError)
 
 
 class XINGEventsImporter:
 
-    def __init__(self, apikey, organizer):
-        self.client = XINGEventsAPIClient(apikey=apikey)
+    def __init__(self, apikey, organizer, client=None):
+        # Any object with the interface of XINGEventsAPIClient can serve as a source, e.g. a snapshot file
+        self.client = client or XINGEventsAPIClient(
+            apikey=apikey,
+            validator_store=CacheValidatorStore(f'xing_validators_{organizer.pk}'),
+        )
         self.organizer = organizer
+        self.voucher_loader = get_loader(Voucher, unique_fields=('event', 'code'), update_fields=VOUCHER_FIELDS)
+        self.answer_loader = get_loader(QuestionAnswer)
         self._tax_rule = None
         self.has_product_definitions = False
+        self._quotas = {}
+
+    @transaction.atomic()
+    def import_event(self, event_id, with_vouchers, with_orders, progress_callback=None):
+        return self._import_event_data(event_id, with_vouchers, with_orders, progress_callback)
 
     @transaction.atomic()
-    def import_event(self, event_id, with_vouchers, with_orders):
-        return self._import_event_data(event_id, with_vouchers, with_orders)
+    def import_event_structure(self, event_id, with_vouchers):
+        """
+        Imports everything but the orders, which can then be imported in parallel using ``import_payment_shard``.
+        """
+        return self._import_event_data(event_id, with_vouchers, with_orders=False)
+
+    def get_payment_ids(self, event_id):
+        # Parsed while it is received, so only the IDs are held in memory and not the whole response
+        return list(self.client.iter_list(f'event/{event_id}/payments', 'payments'))
+
+    def import_payment_shard(self, event, payment_ids, progress_callback=None):
+        """
+        Imports the given payments of an event whose structure has already been committed. Every batch is
+        committed on its own, so multiple shards of the same event can run at the same time.
+        """
+        result = PaymentImportResult()
+        language = event.settings.locale
+        for i in range(0, len(payment_ids), PAYMENT_BATCH_SIZE):
+            batch = payment_ids[i:i + PAYMENT_BATCH_SIZE]
+            with transaction.atomic():
+                self._import_payment_batch(event, language, batch, result, lock=True)
+            if progress_callback:
+                progress_callback(len(batch))
+        return result
+
+    def plan_event(self, event_id, with_vouchers=True, with_orders=True, sample_size=PLAN_SAMPLE_SIZE):
+        plan = ImportPlan(event_id)
+        plan.with_vouchers = with_vouchers
+        plan.with_orders = with_orders
+        requests_before = self.client.request_count
+        time_before = self.client.request_time
+
+        plan.title = self.client._get_memoized(f'event/{event_id}')['event'].get('title')
+        plan.ticket_categories = len(self.client._get(f'event/{event_id}/ticketCategories')['ticketCategories'])
+        plan.product_definitions = len(self.client._get(f'event/{event_id}/productDefinitions')['productDefinitions'])
+        plan.userdata_fields = len(self.client._get(f'event/{event_id}/userData')['userData'])
+
+        if with_vouchers:
+            code_def_ids = self.client._get(f'event/{event_id}/codeDefinitions')['codeDefinitions']
+            plan.code_definitions = len(code_def_ids)
+            for code_def_id in code_def_ids:
+                r_codes = self.client._get(f'codeDefinition/{code_def_id}/codes?page=0')
+                pages = r_codes['lastPage'] - r_codes['currentPage'] + 1
+                plan.code_pages += pages
+                plan.codes += len(r_codes['codes']) * pages
+
+        if with_orders:
+            payment_ids = self.get_payment_ids(event_id)
+            plan.payments = len(payment_ids)
+            sample = payment_ids[:sample_size]
+            if sample:
+                sampled_tickets = sum(
+                    len(self.client._get(f'payment/{payment_id}/tickets')['tickets']) for payment_id in sample
+                )
+                plan.tickets_per_payment = sampled_tickets / len(sample)
+
+        requests_made = self.client.request_count - requests_before
+        if requests_made:
+            plan.latency = (self.client.request_time - time_before) / requests_made
+        return plan
 
     def _clean_html(self, data):
         return bleach.clean(
@@ -48,9 +147,7 @@ class XINGEventsImporter:
         )
 
     def _clone_file(self, event, url, basename):
-        r = requests.get(url)
-        r.raise_for_status()
-        value = ContentFile(r.content)
+        value = ContentFile(self.client.get_file(url))
         nonce = get_random_string(length=8)
         fname = 'pub/%s/%s/%s.%s.%s' % (
             event.organizer.slug, event.slug, basename, nonce, url.rsplit('.', 1)[-1]
@@ -65,18 +162,128 @@ class XINGEventsImporter:
         else:
             return Decimal(int_val) / Decimal('100.00')
 
-    def _import_event_data(self, event_id, with_vouchers, with_orders):
-        d = self.client._get(f'event/{event_id}')['event']
-        ts = self.client._get(f'event/{event_id}/ticketShop')['ticketShop']
+    def _import_event_data(self, event_id, with_vouchers, with_orders, progress_callback=None):
+        # Validators of conditional requests must only be kept if the import is committed
+        self.client.discard_validators()
+        transaction.on_commit(self.client.commit_validators)
+
+        # The API requests of all stages are independent of each other and are sent concurrently right away, while
+        # the database writes below happen in dependency order as soon as the data of their stage is there.
+        with StageScheduler() as stages:
+            stages.add('event', lambda: self._fetch_event(event_id))
+            stages.add('ticketCategories', lambda: self._fetch_ticket_categories(event_id))
+            stages.add('productDefinitions', lambda: self._fetch_product_definitions(event_id))
+            stages.add('userData', lambda: self._fetch_userdata_definitions(event_id))
+            if with_vouchers:
+                stages.add('codeDefinitions', lambda: self._fetch_code_definitions(event_id))
+            event, language = self._write_event_structure(stages, with_vouchers)
+
+        if with_orders:
+            self._import_payments(event, language, event_id, progress_callback)
+            self.refresh_quota_availability(event)
+        return event
+
+    def _fetch_event(self, event_id):
+        d, d_changed = self.client._get_conditional_memoized(f'event/{event_id}')
+        ts, ts_changed = self.client._get_conditional_memoized(f'event/{event_id}/ticketShop')
+        return d['event'], ts['ticketShop'], d_changed or ts_changed
+
+    def _write_event_structure(self, stages, with_vouchers):
+        d, ts, changed = stages.result('event')
 
         try:
             event = self.organizer.events.get(slug=d['identifier'])
+            creating = False
         except Event.DoesNotExist:
             event = Event(slug=d['identifier'], organizer=self.organizer)
+            creating = True
 
         language = d['language'] or 'de'
         tz = pytz.timezone(d['timezone'] or 'Europe/Berlin')
 
+        if creating or changed:
+            self._import_event_settings(event, d, ts, language, tz)
+
+        self._tax_rule = None
+        if ts['commercial'] and ts.get('salesTax'):
+            self._tax_rule = event.tax_rules.get_or_create(
+                rate=Decimal(ts['salesTax']) / Decimal('100.00'),
+                defaults={
+                    'name': LazyI18nString({'de': 'MwSt', 'en': 'VAT'})
+                }
+            )[0]
+
+        # todo: onlineUrl → digitalcontent?
+        # ticketShop.closed?
+
+        # Products depend on the event and its ticket shop as well, e.g. for their tax rule and currency, so they can
+        # only be skipped if neither they nor the event changed
+        self._quotas = {}
+        admission_items = self._import_ticket_categories(
+            event, language, stages.result('ticketCategories'), ts.get('availableLimit'), creating or changed
+        )
+        self._import_product_definitions(
+            event, language, stages.result('productDefinitions'), admission_items, creating or changed
+        )
+        self._import_userdata_definitions(event, language, stages.result('userData'), admission_items)
+        self._apply_quotas(event)
+
+        if with_vouchers:
+            self._import_code_definitions(event, language, stages.result('codeDefinitions'))
+        return event, language
+
+    def _defer_quota(self, name, size, items, variations=()):
+        # Quotas are only written once all products exist, see _apply_quotas
+        q = self._quotas.setdefault(name, {'items': [], 'variations': []})
+        q['size'] = size
+        q['items'] += items
+        q['variations'] += variations
+
+    def _apply_quotas(self, event):
+        """
+        Creates or updates all quotas collected during the structural import stages in one pass, instead of saving
+        every quota and its item assignments individually.
+        """
+        quotas = {}
+        for q in event.quotas.filter(name__in=self._quotas.keys()).order_by('-pk'):
+            quotas[q.name] = q
+
+        to_update = []
+        to_create = []
+        for name, spec in self._quotas.items():
+            if name in quotas:
+                quotas[name].size = spec['size']
+                to_update.append(quotas[name])
+            else:
+                quotas[name] = Quota(event=event, name=name, size=spec['size'])
+                to_create.append(quotas[name])
+        Quota.objects.bulk_update(to_update, ['size'])
+        Quota.objects.bulk_create(to_create)
+
+        Quota.items.through.objects.bulk_create([
+            Quota.items.through(quota_id=quotas[name].pk, item_id=item.pk)
+            for name, spec in self._quotas.items()
+            for item in {i.pk: i for i in spec['items']}.values()
+        ], ignore_conflicts=True)
+        Quota.variations.through.objects.bulk_create([
+            Quota.variations.through(quota_id=quotas[name].pk, itemvariation_id=var.pk)
+            for name, spec in self._quotas.items()
+            for var in {v.pk: v for v in spec['variations']}.values()
+        ], ignore_conflicts=True)
+        self._quotas = {}
+        event.cache.clear()
+
+    def refresh_quota_availability(self, event):
+        """
+        Recomputes the cached availability of all quotas of an event once, after all orders have been written.
+        """
+        # Like pretix's own refresh, the computation stores its results in the availability cache
+        qa = QuotaAvailability(early_out=False, full_results=True)
+        qa.queue(*event.quotas.all())
+        qa.compute()
+        event.cache.clear()
+
+    def _import_event_settings(self, event, d, ts, language, tz):
         event.name = LazyI18nString({language: d['title']})
         event.date_from = tz.localize(parse(d['selectedDate']))
         event.date_to = tz.localize(parse(d['selectedEndDate'])) if d.get('selectedEndDate') else None
@@ -101,14 +308,6 @@ class XINGEventsImporter:
 
         event.save()
 
-        if ts['commercial'] and ts.get('salesTax'):
-            self._tax_rule = event.tax_rules.get_or_create(
-                rate=Decimal(ts['salesTax']) / Decimal('100.00'),
-                defaults={
-                    'name': LazyI18nString({'de': 'MwSt', 'en': 'VAT'})
-                }
-            )[0]
-
         event.enable_plugin("pretix.plugins.badges")
         event.save()
         event.settings.name_scheme = "salutation_given_family"
@@ -196,21 +395,13 @@ class XINGEventsImporter:
         if confirmation_texts:
             event.settings.confirm_texts = confirmation_texts
 
-        # todo: onlineUrl → digitalcontent?
-        # ticketShop.closed?
-
-        admission_items = self._import_ticket_categories(event, language, event_id, ts.get('availableLimit'))
-        self._import_product_definitions(event, language, event_id, admission_items)
-        self._import_userdata_definitions(event, language, event_id, admission_items)
-
-        if with_vouchers:
-            self._import_code_definitions(event, language, event_id)
-
-        if with_orders:
-            self._import_payments(event, language, event_id)
-        return event
+    def _fetch_ticket_categories(self, event_id):
+        return [
+            (category_id, *self.client._get_conditional(f'ticketCategory/{category_id}'))
+            for category_id in self.client._get(f'event/{event_id}/ticketCategories')['ticketCategories']
+        ]
 
-    def _import_ticket_categories(self, event, language, event_id, global_quota_limit):
+    def _import_ticket_categories(self, event, language, categories, global_quota_limit, event_changed=True):
         prop_import_id = event.item_meta_properties.get_or_create(name="XINGEventsTicketkategorie")[0]
         prop_comment = event.item_meta_properties.get_or_create(name="Kommentar")[0]
         item_category = event.categories.get_or_create(
@@ -220,10 +411,9 @@ class XINGEventsImporter:
         )[0]
         all_channels = list(get_all_sales_channels().keys())
 
-        category_ids = self.client._get(f'event/{event_id}/ticketCategories')['ticketCategories']
         items = []
-        for i, category_id in enumerate(category_ids):
-            cat = self.client._get(f'ticketCategory/{category_id}')['ticketCategory']
+        for i, (category_id, cat, changed) in enumerate(categories):
+            cat = cat['ticketCategory']
 
             try:
                 item = ItemMetaValue.objects.get(property=prop_import_id, value=str(category_id), item__event=event).item
@@ -232,6 +422,10 @@ class XINGEventsImporter:
                 item = Item(event=event)
                 creating = True
 
+            if not creating and not changed and not event_changed:
+                items.append(item)
+                continue
+
             item.name = LazyI18nString({language: cat['name']})
             item.admission = True
             item.category = item_category
@@ -261,29 +455,29 @@ class XINGEventsImporter:
             if cat.get('comment'):
                 item.meta_values.update_or_create(property=prop_comment, defaults=dict(value=cat['comment']))
 
-            quota = event.quotas.get_or_create(name=cat.get('internalReference') or cat['name'])[0]
-            quota.size = cat['available'] + cat['sold']  # todo: also + cat['reservedCount ?
-            quota.save()
-            quota.items.add(item)
+            # todo: also + cat['reservedCount ?
+            self._defer_quota(cat.get('internalReference') or cat['name'], cat['available'] + cat['sold'], items=[item])
 
             items.append(item)
 
-        total_quota = event.quotas.get_or_create(name="Gesamt-Teilnehmermenge")[0]
-        total_quota.size = global_quota_limit
-        total_quota.save()
-        total_quota.items.add(*items)
+        self._defer_quota("Gesamt-Teilnehmermenge", global_quota_limit, items=items)
         return items
 
-    def _import_product_definitions(self, event, language, event_id, admission_items):
+    def _fetch_product_definitions(self, event_id):
+        return [
+            (pd_id, *self.client._get_conditional(f'productDefinition/{pd_id}'))
+            for pd_id in self.client._get(f'event/{event_id}/productDefinitions')['productDefinitions']
+        ]
+
+    def _import_product_definitions(self, event, language, product_definitions, admission_items, event_changed=True):
         prop_import_id = event.item_meta_properties.get_or_create(name="XINGEventsProdukt")[0]
         all_channels = list(get_all_sales_channels().keys())
         addon_category = None
 
-        pd_ids = self.client._get(f'event/{event_id}/productDefinitions')['productDefinitions']
         addon_items = []
-        for i, pd_id in enumerate(pd_ids):
+        for i, (pd_id, pd, changed) in enumerate(product_definitions):
             self.has_product_definitions = True
-            pd = self.client._get(f'productDefinition/{pd_id}')['productDefinition']
+            pd = ProductDefinition(pd['productDefinition'], pd_id)
             try:
                 item = ItemMetaValue.objects.get(property=prop_import_id, value=str(pd_id),
                                                  item__event=event).item
@@ -292,7 +486,13 @@ class XINGEventsImporter:
                 item = Item(event=event)
                 creating = True
 
-            if pd['type'] == 'PAYMENT':
+            if not creating and not changed and not event_changed:
+                if pd.type != 'PAYMENT':
+                    addon_category = item.category
+                    addon_items.append(item)
+                continue
+
+            if pd.type == 'PAYMENT':
                 item_category = event.categories.get_or_create(
                     internal_name='Zusätze Bestellung', defaults={
                         'name': LazyI18nString({'en': 'Additional options', 'de': 'Zusätzliche Optionen'})
@@ -306,11 +506,10 @@ class XINGEventsImporter:
                 )[0]
                 addon_items.append(item)
 
-            if len(pd['options']) > 1 or pd['options'][0]['productDefinitionOptionName'] == pd['title']:
-                item.name = LazyI18nString({language: pd['title']})
+            if len(pd.options) > 1 or pd.options[0].name == pd.title:
+                item.name = LazyI18nString({language: pd.title})
             else:
-                item.name = LazyI18nString(
-                    {language: pd['title'] + ' ' + pd['options'][0]['productDefinitionOptionName']})
+                item.name = LazyI18nString({language: pd.title + ' ' + pd.options[0].name})
             item.admission = False
             item.category = item_category
             item.position = i
@@ -324,29 +523,23 @@ class XINGEventsImporter:
             if creating:
                 item.meta_values.create(property=prop_import_id, value=str(pd_id))
 
-            if len(pd['options']) > 1:
-                for pdo in pd['options']:
+            if len(pd.options) > 1:
+                for pdo in pd.options:
                     try:
-                        var = item.variations.get(value__icontains=json.dumps(pdo['productDefinitionOptionName']))
+                        var = item.variations.get(value__icontains=json.dumps(pdo.name))
                     except ItemVariation.DoesNotExist:
                         var = ItemVariation(item=item)
 
-                    var.value = LazyI18nString({language: pdo['productDefinitionOptionName']})
-                    var.default_price = self._money_conversion(event.currency, pdo.get('price', 0))
+                    var.value = LazyI18nString({language: pdo.name})
+                    var.default_price = self._money_conversion(event.currency, pdo.price)
                     var.save()
 
-                    quota = event.quotas.get_or_create(name=str(item.name) + ' ' + pdo['productDefinitionOptionName'])[
-                        0]
-                    quota.size = pdo.get('available')  # todo: add already sold ones
-                    quota.save()
-                    quota.items.add(item)
-                    quota.variations.add(var)
+                    # todo: add already sold ones
+                    self._defer_quota(str(item.name) + ' ' + pdo.name, pdo.available, items=[item], variations=[var])
 
             else:
-                quota = event.quotas.get_or_create(name=str(item.name))[0]
-                quota.size = pd.get('available')  # todo: add already sold ones
-                quota.save()
-                quota.items.add(item)
+                # todo: add already sold ones
+                self._defer_quota(str(item.name), pd.available, items=[item])
 
         if addon_category:
             for item in admission_items:
@@ -358,9 +551,10 @@ class XINGEventsImporter:
                     )
                 )
 
-    def _import_userdata_definitions(self, event, language, event_id, admission_items):
-        userdatas = self.client._get(f'event/{event_id}/userData')['userData']
+    def _fetch_userdata_definitions(self, event_id):
+        return self.client._get(f'event/{event_id}/userData')['userData']
 
+    def _import_userdata_definitions(self, event, language, userdatas, admission_items):
         for ud in userdatas:
             try:
                 question = event.questions.get(identifier=f'xing-{ud["fieldId"]}')
@@ -416,53 +610,220 @@ class XINGEventsImporter:
                         defaults={'answer': LazyI18nString({language: udo["userDataOptionName"]})}
                     )
 
-    def _import_payments(self, event, language, event_id):
-        ids = self.client._get(f'event/{event_id}/payments')['payments']
-        for payment_id in ids:
-            self._import_payment(event, language, event_id, payment_id)
+    def _import_payments(self, event, language, event_id, progress_callback=None):
+        # The list is received completely before the first batch is imported, the response would otherwise stay open
+        # for as long as the whole import takes. It is still parsed while it comes in, without the full payload.
+        ids = list(self.client.iter_list(f'event/{event_id}/payments', 'payments'))
+        result = PaymentImportResult()
+        # Everything runs in a single transaction here, in which an advisory lock per order would be held until the
+        # very end. One lock for the whole event keeps concurrent imports of it apart just as well.
+        lock_keys([f'xing-event-{event.pk}'])
+        for i in range(0, len(ids), PAYMENT_BATCH_SIZE):
+            batch = ids[i:i + PAYMENT_BATCH_SIZE]
+            self._import_payment_batch(event, language, batch, result)
+            if progress_callback:
+                progress_callback(len(batch))
+        return result
+
+    def _import_payment_batch(self, event, language, payment_ids, result, payloads=None, lock=False):
+        result.payments += len(payment_ids)
+        bundles = []
+        order_codes = set()
+        failed = set()
+        # The raw payloads are kept, so failed payments can be stored with theirs without fetching them again
+        payloads = dict(payloads or {})
+        for payment_id in payment_ids:
+            payload = payloads.get(payment_id)
+            try:
+                if not payload:
+                    payload = payloads[payment_id] = self._fetch_payment(payment_id)
+                bundle = self._parse_payment_payload(payment_id, payload) if payload else None
+            except PAYLOAD_ERRORS as e:
+                self._dead_letter(event, payment_id, e, payload)
+                failed.add(payment_id)
+                continue
+            if bundle and bundle.order_code not in order_codes:
+                order_codes.add(bundle.order_code)
+                bundles.append(bundle)
+
+        if lock:
+            # Another shard of the same event might be writing the same order codes or pseudonymization IDs right
+            # now, so we need to lock them and check again for orders created since we fetched the payments. The
+            # locks are released when the batch is committed, so this is only done for batches with their own
+            # transaction.
+            lock_keys(
+                [f'xing-order-{b.order_code}' for b in bundles]
+                + [f'xing-pseudonymization-{t.ticket.display_identifier}' for b in bundles for t in b.tickets]
+            )
+        existing_codes = set(Order.objects.filter(code__in=order_codes).values_list('code', flat=True))
+        bundles = [b for b in bundles if b.order_code not in existing_codes]
+        result.skipped += len(payment_ids) - len(failed) - len(bundles)
 
-    def _import_payment(self, event, language, event_id, payment_id):
-        payment = self.client._get(f'payment/{payment_id}')['payment']
+        pseudonymization_ids = self._resolve_pseudonymization_ids(bundles)
+        args = (event, language, bundles, pseudonymization_ids, payloads)
+        try:
+            # The answers of all payments are written at once. If that fails, the batch is imported again with the
+            # answers of every payment written in its own savepoint, so only the payments with broken answers fail.
+            with transaction.atomic():
+                imported, import_failed = self._import_payment_bundles(*args, answers_per_payment=False)
+        except Exception:
+            logger.warning('Could not write the answers of a batch of XING payments, importing them one by one')
+            imported, import_failed = self._import_payment_bundles(*args, answers_per_payment=True)
+        failed |= import_failed
+        for order, positions in imported:
+            result.add_order(order, positions)
+
+        result.failed += len(failed)
+        FailedPayment.objects.filter(
+            organizer=self.organizer, payment_id__in=[p for p in payment_ids if p not in failed]
+        ).delete()
+
+    def _import_payment_bundles(self, event, language, bundles, pseudonymization_ids, payloads, answers_per_payment):
+        """
+        Imports parsed payments and returns the orders with their positions and the IDs of the payments that failed.
+        """
+        imported = []
+        failed = set()
+        batch_answers = []
+        for bundle in bundles:
+            # Every payment gets its own savepoint, so a single broken payment does not roll back the whole import
+            answers = []
+            try:
+                with transaction.atomic():
+                    order, positions = self._import_payment(event, language, bundle, pseudonymization_ids, answers)
+                    if answers_per_payment:
+                        self.answer_loader.load(answers)
+            except Exception as e:
+                self._dead_letter(event, bundle.payment.id, e, payloads.get(bundle.payment.id))
+                failed.add(bundle.payment.id)
+                continue
+            batch_answers += answers
+            imported.append((order, positions))
+        if not answers_per_payment:
+            self.answer_loader.load(batch_answers)
+        return imported, failed
+
+    def _dead_letter(self, event, payment_id, exc, payload=None):
+        # Without a payload, e.g. if fetching the payment failed, a retry fetches the payment again
+        fp, created = FailedPayment.objects.get_or_create(
+            organizer=self.organizer, payment_id=payment_id, defaults={'event': event, 'attempts': 0},
+        )
+        fp.event = event
+        fp.payload = payload
+        fp.error = f'{type(exc).__name__}: {exc}'
+        fp.traceback = traceback.format_exc()
+        fp.attempts += 1
+        fp.save()
+        logger.warning(f'Could not import XING payment {payment_id}: {fp.error}')
+
+    def retry_failed_payments(self, event, from_payload=False):
+        """
+        Imports the payments of an event that failed before, either fetching them again or from the stored payload.
+        """
+        failed = list(FailedPayment.objects.filter(organizer=self.organizer, event=event))
+        payment_ids = [f.payment_id for f in failed]
+        payloads = {f.payment_id: f.payload for f in failed if f.payload} if from_payload else None
+        result = PaymentImportResult()
+        language = event.settings.locale
+        for i in range(0, len(payment_ids), PAYMENT_BATCH_SIZE):
+            with transaction.atomic():
+                self._import_payment_batch(
+                    event, language, payment_ids[i:i + PAYMENT_BATCH_SIZE], result, payloads, lock=True
+                )
+        self.refresh_quota_availability(event)
+        return result
 
-        if "identifier" in payment:
-            order_code = payment["identifier"][-15:]
-        else:
-            order_code = f"X{payment_id}"
+    def _fetch_payment(self, payment_id):
+        """
+        Returns the raw payload of a payment, or ``None`` if it has been imported already.
+        """
+        payment = self.client._get(f'payment/{payment_id}')['payment']
 
-        if Order.objects.filter(code=order_code).exists():
+        if Order.objects.filter(code=Payment(payment, payment_id).order_code).exists():
             return
 
-        payment_products = self.client._get(f'payment/{payment_id}/products')['products']
-        ticket_ids = self.client._get(f'payment/{payment_id}/tickets')['tickets']
-        tickets = [self.client._get(f'ticket/{ticket_id}')['ticket'] for ticket_id in ticket_ids]
+        return self._fetch_payment_payload(payment_id, payment)
+
+    def _fetch_payment_payload(self, payment_id, payment=None):
+        if payment is None:
+            payment = self.client._get(f'payment/{payment_id}')['payment']
+        tickets = []
+        for ticket_id in self.client._get(f'payment/{payment_id}/tickets')['tickets']:
+            ticket = self.client._get(f'ticket/{ticket_id}')['ticket']
+            tickets.append({
+                'ticket': ticket,
+                'products': self.client._get(f'ticket/{ticket["id"]}/products')['products'],
+                'participant': self.client._get_memoized(f'participant/{ticket["participantId"]}')['participant'],
+            })
+        return {
+            'payment': payment,
+            'products': self.client._get(f'payment/{payment_id}/products')['products'],
+            'tickets': tickets,
+        }
+
+    def _parse_payment_payload(self, payment_id, payload):
+        tickets = []
+        for t in payload['tickets']:
+            ticket = Ticket(t['ticket'], t['ticket'].get('id'))
+            where = f'ticket {ticket.id}'
+            tickets.append(TicketBundle(
+                ticket,
+                [Product(p, where) for p in t['products']],
+                Participant(t['participant'], ticket.participant_id),
+            ))
+        where = f'payment {payment_id}'
+        return PaymentBundle(
+            Payment(payload['payment'], payment_id),
+            [Product(p, where) for p in payload['products']],
+            tickets,
+        )
+
+    def _resolve_pseudonymization_ids(self, bundles):
+        """
+        Returns the pseudonymization ID to use for every ticket of the given payments, keyed by ticket ID.
+        Collisions with positions already in the database are found with a single query, collisions within
+        the batch in memory.
+        """
+        tickets = [t.ticket for b in bundles for t in b.tickets]
+        with scopes_disabled():
+            taken = set(
+                OrderPosition.all.filter(
+                    pseudonymization_id__in={t.display_identifier for t in tickets}
+                ).values_list('pseudonymization_id', flat=True)
+            )
+
+        result = {}
+        for ticket in tickets:
+            if ticket.display_identifier in taken:
+                result[ticket.id] = ticket.display_identifier + f'-{self.organizer.slug}'
+            else:
+                result[ticket.id] = ticket.display_identifier
+                taken.add(ticket.display_identifier)
+        return result
+
+    def _import_payment(self, event, language, bundle, pseudonymization_ids, answers):
+        payment = bundle.payment
         prop_import_id_ticket = event.item_meta_properties.get_or_create(name="XINGEventsTicketkategorie")[0]
         prop_import_id_product = event.item_meta_properties.get_or_create(name="XINGEventsProdukt")[0]
 
-        total = self._money_conversion(event.currency, payment["amount"])
+        total = self._money_conversion(event.currency, payment.amount)
         order = Order(
-            code=order_code,
+            code=payment.order_code,
             event=event,
             testmode=event.testmode,
-            datetime=event.timezone.localize(parse(payment["creationTime"])),
-            email_known_to_work=payment["doubleOptIn"] not in ("FALSE", "WAITING"),
+            datetime=event.timezone.localize(parse(payment.creation_time)),
+            email_known_to_work=payment.double_opt_in not in ("FALSE", "WAITING"),
             meta_info=json.dumps({
-                "xing_import": {
-                    "distributionChannel": payment.get("distributionChannel"),
-                    "applicationData": payment.get("applicationData"),
-                    "type": payment.get("type"),
-                    "paymentAuthLoginType": payment.get("paymentAuthLoginType"),
-                    "paymentAuthProfileUrl": payment.get("paymentAuthProfileUrl"),
-                    "paymentAuthProfileId": payment.get("paymentAuthProfileId"),
-                }
+                "xing_import": payment.meta_info
             }),
-            locale=payment.get("language", language),
+            locale=payment.language or language,
             status={
                 "new": Order.STATUS_PENDING,
                 "authorized": Order.STATUS_PENDING,
                 "paid": Order.STATUS_PAID,
                 "disbursed": Order.STATUS_PAID,
                 "cancelled": Order.STATUS_CANCELED,
-            }[payment["status"]],
+            }[payment.status],
             total=total,
         )
 
@@ -480,11 +841,11 @@ class XINGEventsImporter:
         positions = []
         fees = []
 
-        for ticket in tickets:
-            ticket_products = self.client._get(f'ticket/{ticket["id"]}/products')['products']
-            participant = self.client._get(f'participant/{ticket["participantId"]}')['participant']
+        for t in bundle.tickets:
+            ticket = t.ticket
+            participant = t.participant
 
-            if participant["status"] == "com.amiando.participant.status.onHold" and order.status != Order.STATUS_CANCELED:
+            if participant.status == "com.amiando.participant.status.onHold" and order.status != Order.STATUS_CANCELED:
                 order.require_approval = True
                 order.status = Order.STATUS_PENDING
                 order.save()
@@ -492,15 +853,11 @@ class XINGEventsImporter:
             op = OrderPosition(order=order, positionid=len(positions) + 1)
             op.item = ItemMetaValue.objects.get(
                 property=prop_import_id_ticket,
-                value=str(ticket["ticketCategoryIds"][0]),
+                value=str(ticket.category_id),
                 item__event=event,
             ).item
-            op.secret = ticket["identifier"]
-            with scopes_disabled():
-                if OrderPosition.all.filter(pseudonymization_id=ticket["displayIdentifier"]).exists():
-                    op.pseudonymization_id = ticket["displayIdentifier"] + f'-{self.organizer.slug}'
-                else:
-                    op.pseudonymization_id = ticket["displayIdentifier"]
+            op.secret = ticket.identifier
+            op.pseudonymization_id = pseudonymization_ids[ticket.id]
             op.attendee_name_parts = {
                 "_scheme": "salutation_given_family",
                 "saludation": {
@@ -508,123 +865,126 @@ class XINGEventsImporter:
                     1: 'Ms',
                     -1: 'Mx',
                     None: '',
-                }[ticket.get("salutation")],
-                "given_name": ticket.get("firstName") or "",
-                "familyName": ticket.get("lastName") or "",
+                }[ticket.salutation],
+                "given_name": ticket.first_name,
+                "familyName": ticket.last_name,
             }
-            op.attendee_email = ticket.get("email")
-            op.company = ticket.get("company")
+            op.attendee_email = ticket.email
+            op.company = ticket.company
 
-            op.price = self._money_conversion(event.currency, ticket.get("originalPrice", 0)) - self._money_conversion(event.currency, ticket.get("discountAmount", 0))
+            op.price = self._money_conversion(event.currency, ticket.original_price) - self._money_conversion(event.currency, ticket.discount_amount)
 
-            if ticket.get("cancelled") or participant["status"] in ("com.amiando.participant.status.cancelled", "com.amiando.participant.status.declined"):
+            if ticket.cancelled or participant.status in ("com.amiando.participant.status.cancelled", "com.amiando.participant.status.declined"):
                 op.canceled = True  # todo: test this
 
             op.save()
             positions.append(op)
 
-            if participant.get("referenceNumber") and not ia.internal_reference:
-                ia.internal_reference = participant["referenceNumber"]
+            if participant.reference_number and not ia.internal_reference:
+                ia.internal_reference = participant.reference_number
                 ia.save()
-            if participant.get("buyerAddress") and not ia.city:
+            if participant.buyer_address and not ia.city:
+                buyer_address = participant.buyer_address
                 ia.name_parts = {
                     '_scheme': 'salutation_given_family',
                     'salutation': '',
-                    'given_name': participant['buyerAddress'].get('firstName') or '',
-                    'family_name': participant['buyerAddress'].get('lastName') or '',
+                    'given_name': buyer_address.first_name,
+                    'family_name': buyer_address.last_name,
                 }
-                ia.company = participant['buyerAddress'].get('company') or ''
-                ia.street = participant['buyerAddress'].get('street') or ''
-                ia.zipcode = participant['buyerAddress'].get('zipCode') or ''
-                ia.city = participant['buyerAddress'].get('city') or ''
-                ia.country = participant['buyerAddress'].get('country') or 'DE'
-                ia.vat_id = participant['buyerAddress'].get('vatId') or ''
+                ia.company = buyer_address.company
+                ia.street = buyer_address.street
+                ia.zipcode = buyer_address.zip_code
+                ia.city = buyer_address.city
+                ia.country = buyer_address.country
+                ia.vat_id = buyer_address.vat_id
                 ia.save()
-                if participant['buyerAddress'].get('email') and not order.email:
-                    order.email = participant['buyerAddress'].get('email')
+                if buyer_address.email and not order.email:
+                    order.email = buyer_address.email
                     order.save()
-                if participant['buyerAddress'].get('telephone') and not order.phone:
-                    order.phone = participant['buyerAddress'].get('telephone')
+                if buyer_address.telephone and not order.phone:
+                    order.phone = buyer_address.telephone
                     order.save()
             elif not order.email:
-                order.email = participant.get("email")
+                order.email = participant.email
                 order.save()
 
-            for ud in chain(ticket.get("userData", []), payment.get("userData", [])):
-                if ud['type'] in ("separator", "product", "unknown", "agb", "privacy"):
+            for ud in chain(ticket.userdata, payment.userdata):
+                if ud.type in ("separator", "product", "unknown", "agb", "privacy"):
                     continue
-                question = event.questions.get(identifier=f'xing-{ud["fieldId"]}')
+                question = event.questions.get(identifier=f'xing-{ud.field_id}')
                 qa = QuestionAnswer(question=question, orderposition=op)
-                if ud['type'] in ("date", "birthday"):
-                    qa.answer = str(parse(ud["value"]).date())
-                elif ud['type'] == "datetime":
-                    qa.answer = str(event.timezone.localize(parse(ud["value"])))
-                elif ud['type'] in ("radio", "dropdown"):
-                    opt = question.options.get(identifier=f'xing-{ud["userDataOptionKey"]}')
+                if ud.type in ("date", "birthday"):
+                    qa.answer = str(parse(ud.value).date())
+                elif ud.type == "datetime":
+                    qa.answer = str(event.timezone.localize(parse(ud.value)))
+                elif ud.type in ("radio", "dropdown"):
+                    opt = question.options.get(identifier=f'xing-{ud.option_key}')
                     qa.answer = str(opt.answer)
                     qa.save()
                     qa.options.set([opt])
-                elif ud['type'] == "checkbox":
-                    qa.answer = str(ud['value'])
-                elif ud['type'] in ("photo", "file"):
-                    r = requests.get(ud['value'])
-                    r.raise_for_status()
-                    value = ContentFile(r.content)
+                    continue
+                elif ud.type == "checkbox":
+                    qa.answer = str(ud.value)
+                elif ud.type in ("photo", "file"):
+                    value = ContentFile(self.client.get_file(ud.value))
                     qa.save()
-                    qa.file.save(os.path.basename(urlparse(ud["value"]).path), value, save=False)
+                    qa.file.save(os.path.basename(urlparse(ud.value).path), value, save=False)
                     qa.answer = 'file://' + qa.file.name
-                elif ud['type'] == "address":
+                    qa.save()
+                    continue
+                elif ud.type == "address":
                     qa.answer = (
-                        f"{ud['value'].get('firstName', '')} {ud['value'].get('lastName', '')}\n"
-                        f"{ud['value'].get('street', '')}\n" 
-                        f"{ud['value'].get('zipCode', '')} {ud['value'].get('city', '')}\n"
-                        f"{ud['value'].get('country', '')}\n" 
-                        f"{ud['value'].get('email', '')}"
+                        f"{ud.value.get('firstName', '')} {ud.value.get('lastName', '')}\n"
+                        f"{ud.value.get('street', '')}\n"
+                        f"{ud.value.get('zipCode', '')} {ud.value.get('city', '')}\n"
+                        f"{ud.value.get('country', '')}\n"
+                        f"{ud.value.get('email', '')}"
                     ).strip()
                 else:
-                    # if ud['type'] in ("string", "email", "url", "textarea", "gender", "phone", "country"):
-                    qa.answer = str(ud["value"])
-                qa.save()
+                    # if ud.type in ("string", "email", "url", "textarea", "gender", "phone", "country"):
+                    qa.answer = str(ud.value)
+                # Plain answers are written together with those of the other payments of the batch
+                answers.append({'question': question, 'orderposition': op, 'answer': qa.answer})
 
-            if ticket.get("checked"):
+            if ticket.checked:
                 Checkin.objects.create(
                     position=op,
-                    datetime=event.timezone.localize(parse(ticket.get("lastChecked"))),
+                    datetime=event.timezone.localize(parse(ticket.last_checked)),
                     list=event.checkin_lists.get_or_create(name="Default")[0]
                 )
 
-            for prod in ticket_products:
+            for prod in t.products:
                 opa = OrderPosition(order=order, addon_to=op, canceled=op.canceled, positionid=len(positions) + 1)
                 opa.item = ItemMetaValue.objects.get(
                     property=prop_import_id_product,
-                    value=str(prod["productCategoryId"]),
+                    value=str(prod.category_id),
                     item__event=event,
                 ).item
-                opa.variation = opa.item.variations.get(value__icontains=json.dumps(prod['productCategoryOptionName'])) if opa.item.variations.exists() else None
+                opa.variation = opa.item.variations.get(value__icontains=json.dumps(prod.option_name)) if opa.item.variations.exists() else None
                 opa.price = opa.variation.default_price if opa.variation else opa.item.default_price
                 opa.save()
                 positions.append(opa)
 
-                if prod.get("checked"):
+                if prod.checked:
                     Checkin.objects.create(
                         position=opa,
                         list=event.checkin_lists.get_or_create(name="Default")[0]
                     )
 
-        for prod in payment_products:
+        for prod in bundle.products:
             opp = OrderPosition(order=order, positionid=len(positions) + 1)
             opp.item = ItemMetaValue.objects.get(
                 property=prop_import_id_product,
-                value=str(prod["productCategoryId"]),
+                value=str(prod.category_id),
                 item__event=event,
             ).item
             opp.variation = opp.item.variations.get(value__icontains=json.dumps(
-                prod['productCategoryOptionName'])) if opp.item.variations.exists() else None
-            opp.price = opp.variation.default_price if opp.variation else opa.item.default_price
+                prod.option_name)) if opp.item.variations.exists() else None
+            opp.price = opp.variation.default_price if opp.variation else opp.item.default_price
             opp.save()
             positions.append(opp)
 
-            if prod.get("checked"):
+            if prod.checked:
                 Checkin.objects.create(
                     position=opp,
                     list=event.checkin_lists.get_or_create(name="Default")[0]
@@ -649,14 +1009,22 @@ class XINGEventsImporter:
                 amount=order.total, provider='manual', state=OrderPayment.PAYMENT_STATE_CONFIRMED,
                 payment_date=now()
             )
+        return order, positions
+
+    def _fetch_code_definitions(self, event_id):
+        # Only the definitions, the codes themselves are paged and fetched while they are written
+        return [
+            (code_def_id, *self.client._get_conditional(f'codeDefinition/{code_def_id}'))
+            for code_def_id in self.client._get(f'event/{event_id}/codeDefinitions')['codeDefinitions']
+        ]
 
-    def _import_code_definitions(self, event, language, event_id):
+    def _import_code_definitions(self, event, language, code_definitions):
         prop_import_id_ticket = event.item_meta_properties.get_or_create(name="XINGEventsTicketkategorie")[0]
-        code_def_ids = self.client._get(f'event/{event_id}/codeDefinitions')['codeDefinitions']
-        for code_def_id in code_def_ids:
-            code_def = self.client._get(f'codeDefinition/{code_def_id}')['codeDefinition']
+        for code_def_id, code_def, changed in code_definitions:
+            code_def = code_def['codeDefinition']
 
             valid_until = event.timezone.localize(parse(code_def['endDate'])) if code_def.get('endDate') else None
+            item = quota = None
             if code_def.get('categories', []):
                 if len(code_def['categories']) == 1:
                     item = ItemMetaValue.objects.get(
@@ -664,8 +1032,7 @@ class XINGEventsImporter:
                         value=str(code_def["categories"][0]),
                         item__event=event,
                     ).item
-                    quota = None
-                    if code_def['type'] == 'DISCOUNTCODE_TYPE_CATEGORY':
+                    if changed and code_def['type'] == 'DISCOUNTCODE_TYPE_CATEGORY':
                         item.hide_without_voucher = True
                         item.save()
                 else:
@@ -677,46 +1044,59 @@ class XINGEventsImporter:
                             item__event=event,
                         )
                     ]
-                    q.items.set(items)
                     quota = q
-                    item = None
-                    if code_def['type'] == 'DISCOUNTCODE_TYPE_CATEGORY':
+                    if changed:
+                        q.items.set(items)
+                    if changed and code_def['type'] == 'DISCOUNTCODE_TYPE_CATEGORY':
                         for i in items:
                             i.hide_without_voucher = True
                             i.save()
 
             page_num = 0
             while True:
-                r_codes = self.client._get(f'codeDefinition/{code_def_id}/codes?page={page_num}')
-
-                for code in r_codes['codes']:
-                    try:
-                        v = event.vouchers.get(code=code['code'])
-                    except Voucher.DoesNotExist:
-                        v = Voucher(event=event, code=code['code'])
-
-                    v.redeemed = code['used']
-                    v.tag = code_def['name']
-                    v.item = item
-                    v.quota = quota
-                    v.max_usages = code_def.get('validCount') or 10_000_000
-                    v.valid_until = valid_until
-
-                    if code_def['type'] == 'DISCOUNTCODE_TYPE_PERCENT':
-                        v.price_mode = 'percent'
-                        v.value = Decimal(code_def['value']) / Decimal('100.00')
-                        v.show_hidden_items = False
-                    elif code_def['type'] == 'DISCOUNTCODE_TYPE_ABSOLUTE':
-                        v.price_mode = 'subtract'
-                        v.value = self._money_conversion(event.currency, code_def['value'])
-                        v.show_hidden_items = False
-                    elif code_def['type'] == 'DISCOUNTCODE_TYPE_CATEGORY':
-                        v.price_mode = 'none'
-                        v.show_hidden_items = True
-
-                    v.save()
-
-                if r_codes['currentPage'] == r_codes['lastPage']:
+                page = {}
+                codes = self.client.iter_list(f'codeDefinition/{code_def_id}/codes?page={page_num}', 'codes', page)
+                while True:
+                    batch = list(islice(codes, VOUCHER_BATCH_SIZE))
+                    if not batch:
+                        break
+                    self._import_code_batch(event, code_def, batch, item, quota, valid_until)
+
+                if page['currentPage'] == page['lastPage']:
                     break
                 else:
                     page_num += 1
+
+    def _import_code_batch(self, event, code_def, codes, item, quota, valid_until):
+        rows = {}
+        for code in codes:
+            # Voucher.save() upper-cases the code, which the loaders skip. Codes that only differ in case are the
+            # same voucher in pretix.
+            voucher_code = code['code'].upper()
+            v = rows[voucher_code] = {
+                'event': event,
+                'code': voucher_code,
+                'redeemed': code['used'],
+                'tag': code_def['name'],
+                'item': item,
+                'quota': quota,
+                'max_usages': code_def.get('validCount') or 10_000_000,
+                'valid_until': valid_until,
+                'value': None,
+            }
+
+            if code_def['type'] == 'DISCOUNTCODE_TYPE_PERCENT':
+                v['price_mode'] = 'percent'
+                v['value'] = Decimal(code_def['value']) / Decimal('100.00')
+                v['show_hidden_items'] = False
+            elif code_def['type'] == 'DISCOUNTCODE_TYPE_ABSOLUTE':
+                v['price_mode'] = 'subtract'
+                v['value'] = self._money_conversion(event.currency, code_def['value'])
+                v['show_hidden_items'] = False
+            elif code_def['type'] == 'DISCOUNTCODE_TYPE_CATEGORY':
+                v['price_mode'] = 'none'
+                v['show_hidden_items'] = True
+
+        self.voucher_loader.load(list(rows.values()))
+        # Voucher.save() would remember this for the shop front page as well
+        event.cache.set('vouchers_exist', True)
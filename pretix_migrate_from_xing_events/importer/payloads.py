@@ -0,0 +1,211 @@
+"""
+Compact representations of the XING Events payloads the importer buffers in large numbers. They only keep the
+fields the importer actually maps and validate them while parsing, so unexpected data fails with a clear message
+before anything is written to the database.
+"""
+from pretix_migrate_from_xing_events.importer.client import APIError
+
+PAYMENT_STATUSES = ('new', 'authorized', 'paid', 'disbursed', 'cancelled')
+SALUTATIONS = (0, 1, -1, None)
+NUMBER = (int, float)
+
+
+class SchemaError(APIError):
+    pass
+
+
+def _required(d, key, types, where):
+    try:
+        value = d[key]
+    except (KeyError, TypeError):
+        raise SchemaError(f'{where} has no field "{key}"')
+    if not isinstance(value, types):
+        raise SchemaError(f'{where} has an unexpected value for "{key}": {value!r}')
+    return value
+
+
+def _optional(d, key, types, where, default=None):
+    value = d.get(key)
+    if value is None:
+        return default
+    if not isinstance(value, types):
+        raise SchemaError(f'{where} has an unexpected value for "{key}": {value!r}')
+    return value
+
+
+class Payload:
+    __slots__ = ()
+
+    def __repr__(self):
+        return '<{} {}>'.format(
+            type(self).__name__, ' '.join(f'{k}={getattr(self, k)!r}' for k in self.__slots__)
+        )
+
+
+class UserData(Payload):
+    __slots__ = ('type', 'field_id', 'value', 'option_key')
+
+    def __init__(self, d, where):
+        where = f'{where} userData'
+        self.type = _required(d, 'type', str, where)
+        self.field_id = d.get('fieldId')
+        self.value = d.get('value')
+        self.option_key = d.get('userDataOptionKey')
+
+    @classmethod
+    def parse_list(cls, d, where):
+        return [cls(ud, where) for ud in _optional(d, 'userData', list, where, default=[])]
+
+
+class Product(Payload):
+    """
+    A product bought as part of a payment or ticket.
+    """
+    __slots__ = ('category_id', 'option_name', 'checked')
+
+    def __init__(self, d, where):
+        where = f'{where} product'
+        self.category_id = _required(d, 'productCategoryId', (int, str), where)
+        self.option_name = _required(d, 'productCategoryOptionName', str, where)
+        self.checked = bool(d.get('checked'))
+
+
+class ProductDefinitionOption(Payload):
+    __slots__ = ('name', 'price', 'available')
+
+    def __init__(self, d, where):
+        where = f'{where} option'
+        self.name = _required(d, 'productDefinitionOptionName', str, where)
+        self.price = _optional(d, 'price', NUMBER, where, default=0)
+        self.available = _optional(d, 'available', int, where)
+
+
+class ProductDefinition(Payload):
+    __slots__ = ('id', 'type', 'title', 'available', 'options')
+
+    def __init__(self, d, pd_id):
+        where = f'productDefinition {pd_id}'
+        self.id = pd_id
+        self.type = _required(d, 'type', str, where)
+        self.title = _required(d, 'title', str, where)
+        self.available = _optional(d, 'available', int, where)
+        self.options = [ProductDefinitionOption(o, where) for o in _required(d, 'options', list, where)]
+        if not self.options:
+            raise SchemaError(f'{where} has no options')
+
+
+class BuyerAddress(Payload):
+    __slots__ = ('first_name', 'last_name', 'company', 'street', 'zip_code', 'city', 'country', 'vat_id', 'email',
+                 'telephone')
+
+    def __init__(self, d):
+        self.first_name = d.get('firstName') or ''
+        self.last_name = d.get('lastName') or ''
+        self.company = d.get('company') or ''
+        self.street = d.get('street') or ''
+        self.zip_code = d.get('zipCode') or ''
+        self.city = d.get('city') or ''
+        self.country = d.get('country') or 'DE'
+        self.vat_id = d.get('vatId') or ''
+        self.email = d.get('email')
+        self.telephone = d.get('telephone')
+
+
+class Participant(Payload):
+    __slots__ = ('id', 'status', 'reference_number', 'email', 'buyer_address')
+
+    def __init__(self, d, participant_id):
+        where = f'participant {participant_id}'
+        self.id = participant_id
+        self.status = _required(d, 'status', str, where)
+        self.reference_number = d.get('referenceNumber')
+        self.email = d.get('email')
+        buyer_address = _optional(d, 'buyerAddress', dict, where)
+        self.buyer_address = BuyerAddress(buyer_address) if buyer_address else None
+
+
+class Ticket(Payload):
+    __slots__ = ('id', 'identifier', 'display_identifier', 'category_id', 'participant_id', 'salutation',
+                 'first_name', 'last_name', 'email', 'company', 'original_price', 'discount_amount', 'cancelled',
+                 'checked', 'last_checked', 'userdata')
+
+    def __init__(self, d, ticket_id):
+        where = f'ticket {ticket_id}'
+        self.id = _required(d, 'id', (int, str), where)
+        self.identifier = _required(d, 'identifier', str, where)
+        self.display_identifier = _required(d, 'displayIdentifier', str, where)
+        category_ids = _required(d, 'ticketCategoryIds', list, where)
+        if not category_ids:
+            raise SchemaError(f'{where} has no ticket category')
+        self.category_id = category_ids[0]
+        self.participant_id = _required(d, 'participantId', (int, str), where)
+        self.salutation = d.get('salutation')
+        if self.salutation not in SALUTATIONS:
+            raise SchemaError(f'{where} has an unexpected value for "salutation": {self.salutation!r}')
+        self.first_name = d.get('firstName') or ''
+        self.last_name = d.get('lastName') or ''
+        self.email = d.get('email')
+        self.company = d.get('company')
+        self.original_price = _optional(d, 'originalPrice', NUMBER, where, default=0)
+        self.discount_amount = _optional(d, 'discountAmount', NUMBER, where, default=0)
+        self.cancelled = bool(d.get('cancelled'))
+        self.checked = bool(d.get('checked'))
+        self.last_checked = d.get('lastChecked')
+        if self.checked and not self.last_checked:
+            raise SchemaError(f'{where} is checked in, but has no "lastChecked"')
+        self.userdata = UserData.parse_list(d, where)
+
+
+class Payment(Payload):
+    __slots__ = ('id', 'identifier', 'amount', 'creation_time', 'double_opt_in', 'language', 'status', 'meta_info',
+                 'userdata')
+
+    def __init__(self, d, payment_id):
+        where = f'payment {payment_id}'
+        self.id = payment_id
+        self.identifier = _optional(d, 'identifier', str, where)
+        self.amount = _required(d, 'amount', NUMBER, where)
+        self.creation_time = _required(d, 'creationTime', str, where)
+        self.double_opt_in = _required(d, 'doubleOptIn', str, where)
+        self.language = d.get('language')
+        self.status = _required(d, 'status', str, where)
+        if self.status not in PAYMENT_STATUSES:
+            raise SchemaError(f'{where} has an unexpected status: {self.status!r}')
+        self.meta_info = {
+            k: d.get(k) for k in (
+                'distributionChannel', 'applicationData', 'type', 'paymentAuthLoginType', 'paymentAuthProfileUrl',
+                'paymentAuthProfileId',
+            )
+        }
+        self.userdata = UserData.parse_list(d, where)
+
+    @property
+    def order_code(self):
+        if self.identifier:
+            return self.identifier[-15:]
+        return f'X{self.id}'
+
+
+class TicketBundle(Payload):
+    __slots__ = ('ticket', 'products', 'participant')
+
+    def __init__(self, ticket, products, participant):
+        self.ticket = ticket
+        self.products = products
+        self.participant = participant
+
+
+class PaymentBundle(Payload):
+    """
+    A payment with everything that belongs to it, as fetched before the batch is written.
+    """
+    __slots__ = ('payment', 'products', 'tickets')
+
+    def __init__(self, payment, products, tickets):
+        self.payment = payment
+        self.products = products
+        self.tickets = tickets
+
+    @property
+    def order_code(self):
+        return self.payment.order_code
@@ -0,0 +1,83 @@
+import math
+
+# Rough time pretix needs to write one row including signal handlers, used on top of the measured API latency.
+ROW_WRITE_SECONDS = 0.005
+
+# Used if neither the API latency could be measured nor a sample could be taken.
+DEFAULT_LATENCY_SECONDS = 0.3
+
+
+class ImportPlan:
+    """
+    Expected cost of importing a single XING event, computed from the list endpoints only.
+
+    Per-payment and per-ticket numbers are extrapolated from a small sample of payments, so all numbers
+    are estimates.
+    """
+
+    def __init__(self, event_id, title=None):
+        self.event_id = event_id
+        self.title = title
+        self.ticket_categories = 0
+        self.product_definitions = 0
+        self.userdata_fields = 0
+        self.code_definitions = 0
+        self.code_pages = 0
+        self.codes = 0
+        self.payments = 0
+        self.tickets_per_payment = 1.0
+        self.latency = DEFAULT_LATENCY_SECONDS
+        self.with_vouchers = True
+        self.with_orders = True
+
+    @property
+    def tickets(self):
+        return int(math.ceil(self.payments * self.tickets_per_payment))
+
+    @property
+    def api_calls(self):
+        # event, ticketShop, the list endpoints and one detail call per category and product
+        calls = 2 + 3 + self.ticket_categories + self.product_definitions
+        if self.with_vouchers:
+            calls += 1 + self.code_definitions + self.code_pages
+        if self.with_orders:
+            # payment, payment products, payment tickets + ticket, ticket products, participant per ticket
+            calls += 1 + 3 * self.payments + 3 * self.tickets
+        return calls
+
+    @property
+    def rows(self):
+        # items, their meta values and quotas
+        rows = 3 * (self.ticket_categories + self.product_definitions) + self.userdata_fields
+        if self.with_vouchers:
+            rows += self.codes
+        if self.with_orders:
+            # order, invoice address and payment per order, one position per ticket
+            rows += 3 * self.payments + self.tickets
+        return rows
+
+    @property
+    def estimated_duration(self):
+        return self.api_calls * self.latency + self.rows * ROW_WRITE_SECONDS
+
+    @property
+    def estimated_minutes(self):
+        return int(math.ceil(self.estimated_duration / 60))
+
+    def as_dict(self):
+        return {
+            'event_id': self.event_id,
+            'title': self.title,
+            'ticket_categories': self.ticket_categories,
+            'product_definitions': self.product_definitions,
+            'userdata_fields': self.userdata_fields,
+            'code_definitions': self.code_definitions,
+            'code_pages': self.code_pages,
+            'codes': self.codes,
+            'payments': self.payments,
+            'tickets': self.tickets,
+            'api_calls': self.api_calls,
+            'rows': self.rows,
+            'latency': self.latency,
+            'estimated_duration': self.estimated_duration,
+        }
@@ -0,0 +1,115 @@
+"""
+Compares an imported event with its XING event using aggregates only, so the check takes seconds even for events
+with a huge number of tickets. XING only offers totals for some of them, the others are reported for pretix only.
+"""
+from django.db.models import Count, Sum
+
+from pretix.base.models import Checkin, Event, Order, OrderPosition
+from pretix_migrate_from_xing_events.importer.stages import StageScheduler
+from pretix_migrate_from_xing_events.models import FailedPayment
+
+
+class Reconciliation:
+    """
+    Pairs of XING and pretix values for one event. A XING value of ``None`` means XING does not offer that total.
+    """
+
+    def __init__(self, event_id, title=None, slug=None):
+        self.event_id = event_id
+        self.title = title
+        self.slug = slug
+        self.rows = []
+
+    def add(self, name, xing, pretix):
+        self.rows.append((name, xing, pretix))
+
+    @property
+    def differences(self):
+        return [(name, xing, pretix) for name, xing, pretix in self.rows if xing is not None and xing != pretix]
+
+    @property
+    def ok(self):
+        return self.slug is not None and not self.differences
+
+    def as_dict(self):
+        return {
+            'event_id': self.event_id,
+            'title': self.title,
+            'slug': self.slug,
+            'ok': self.ok,
+            'rows': [{'name': name, 'xing': xing, 'pretix': pretix} for name, xing, pretix in self.rows],
+        }
+
+
+def _fetch_categories(client, event_id):
+    return [
+        (category_id, client._get(f'ticketCategory/{category_id}')['ticketCategory'])
+        for category_id in client._get(f'event/{event_id}/ticketCategories')['ticketCategories']
+    ]
+
+
+def _fetch_payment_count(client, event_id):
+    return sum(1 for __ in client.iter_list(f'event/{event_id}/payments', 'payments'))
+
+
+def _fetch_code_totals(client, event_id):
+    count = used = 0
+    for code_def_id in client._get(f'event/{event_id}/codeDefinitions')['codeDefinitions']:
+        page_num = 0
+        while True:
+            page = {}
+            for code in client.iter_list(f'codeDefinition/{code_def_id}/codes?page={page_num}', 'codes', page):
+                count += 1
+                used += code['used']
+            if page['currentPage'] == page['lastPage']:
+                break
+            page_num += 1
+    return count, used
+
+
+def reconcile_event(client, organizer, event_id):
+    with StageScheduler() as stages:
+        stages.add('event', lambda: client._get(f'event/{event_id}')['event'])
+        stages.add('ticketCategories', lambda: _fetch_categories(client, event_id))
+        stages.add('payments', lambda: _fetch_payment_count(client, event_id))
+        stages.add('codes', lambda: _fetch_code_totals(client, event_id))
+
+        d = stages.result('event')
+        r = Reconciliation(event_id, title=d.get('title'))
+        try:
+            event = organizer.events.get(slug=d['identifier'])
+        except Event.DoesNotExist:
+            return r
+        r.slug = event.slug
+
+        orders = Order.objects.filter(event=event)
+        r.add('payments', stages.result('payments'), orders.count())
+        r.add('failed_payments', None, FailedPayment.objects.filter(organizer=organizer, event=event).count())
+        for s in orders.order_by().values('status').annotate(c=Count('id'), total=Sum('total')).order_by('status'):
+            r.add(f'orders.{s["status"]}', None, s['c'])
+            r.add(f'revenue.{s["status"]}', None, str(s['total']))
+
+        categories = stages.result('ticketCategories')
+        sold = dict(
+            OrderPosition.objects.filter(
+                order__event=event,
+                addon_to__isnull=True,
+                item__meta_values__property__name='XINGEventsTicketkategorie',
+            ).exclude(
+                order__status=Order.STATUS_CANCELED
+            ).order_by().values_list('item__meta_values__value').annotate(c=Count('id'))
+        )
+        quota_names = {category_id: cat.get('internalReference') or cat['name'] for category_id, cat in categories}
+        quota_sizes = dict(event.quotas.filter(name__in=quota_names.values()).values_list('name', 'size'))
+        for category_id, cat in categories:
+            r.add(f'category.{category_id}.sold', cat['sold'], sold.get(str(category_id), 0))
+            r.add(f'category.{category_id}.capacity', cat['available'] + cat['sold'],
+                  quota_sizes.get(quota_names[category_id]))
+
+        r.add('checkins', None, Checkin.objects.filter(position__order__event=event).count())
+
+        codes, used = stages.result('codes')
+        vouchers = event.vouchers.aggregate(c=Count('id'), redeemed=Sum('redeemed'))
+        r.add('vouchers', codes, vouchers['c'])
+        r.add('vouchers.redeemed', used, vouchers['redeemed'] or 0)
+    return r
@@ -0,0 +1,76 @@
+from decimal import Decimal
+
+# Events with fewer payments are not worth the overhead of splitting them up
+SHARD_MIN_PAYMENTS = 1000
+
+
+def split_into_shards(payment_ids, shards):
+    """
+    Splits a list of payment IDs into up to ``shards`` contiguous ranges of similar size.
+    """
+    payment_ids = sorted(payment_ids)
+    shards = max(1, min(shards, len(payment_ids)))
+    size, rest = divmod(len(payment_ids), shards)
+    ranges = []
+    start = 0
+    for i in range(shards):
+        end = start + size + (1 if i < rest else 0)
+        ranges.append(payment_ids[start:end])
+        start = end
+    return [r for r in ranges if r]
+
+
+class PaymentImportResult:
+    """
+    Counts what happened during the import of (a shard of) the payments of an event. Results of shards are
+    merged into one after all shards are done.
+    """
+
+    def __init__(self):
+        self.payments = 0
+        self.skipped = 0
+        self.failed = 0
+        self.orders = 0
+        self.positions = 0
+        self.paid_orders = 0
+        self.total = Decimal('0.00')
+
+    def add_order(self, order, positions):
+        self.orders += 1
+        self.positions += len(positions)
+        self.total += order.total
+        if order.status == order.STATUS_PAID:
+            self.paid_orders += 1
+
+    def merge(self, other):
+        self.payments += other.payments
+        self.skipped += other.skipped
+        self.failed += other.failed
+        self.orders += other.orders
+        self.positions += other.positions
+        self.paid_orders += other.paid_orders
+        self.total += other.total
+        return self
+
+    def as_dict(self):
+        return {
+            'payments': self.payments,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'orders': self.orders,
+            'positions': self.positions,
+            'paid_orders': self.paid_orders,
+            'total': str(self.total),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        r = cls()
+        r.payments = d['payments']
+        r.skipped = d['skipped']
+        r.failed = d.get('failed', 0)
+        r.orders = d['orders']
+        r.positions = d['positions']
+        r.paid_orders = d['paid_orders']
+        r.total = Decimal(d['total'])
+        return r
@@ -0,0 +1,187 @@
+"""
+Snapshots of all XING Events data of an account, so it can be imported into pretix after the XING account has been
+closed, and as often as needed.
+
+A snapshot is a single file that is a valid multi-member gzip stream, i.e. ``zcat`` returns JSON lines. Every line
+is its own gzip member, which allows random access to single records:
+
+* The first line is a header of fixed size containing the offset of the index.
+* Every following line contains the API path a payload was fetched from and the payload.
+* The last line is the index, mapping every path to the offset of its record.
+
+Files referenced by the payloads (logos, terms and conditions, uploaded answers) are stored base64-encoded with
+their URL as path.
+"""
+import base64
+import gzip
+import json
+import threading
+
+from pretix_migrate_from_xing_events.importer.client import APIError, XINGEventsAPIClient
+
+FORMAT = 'pretix-xing-events-snapshot'
+VERSION = 1
+
+
+def _member(d, compresslevel=6):
+    return gzip.compress((json.dumps(d, separators=(',', ':')) + '\n').encode(), compresslevel=compresslevel, mtime=0)
+
+
+def _header(index_offset):
+    # Stored without compression and with a zero-padded offset, so the header always has the same size and can be
+    # overwritten once the offset of the index is known.
+    return _member({'format': FORMAT, 'version': VERSION, 'index': '%020d' % index_offset}, compresslevel=0)
+
+
+class SnapshotWriter:
+    """
+    Writes records to a seekable binary file object as they come in, only the index is kept in memory.
+    """
+
+    def __init__(self, fileobj):
+        self.f = fileobj
+        self.index = {}
+        self.f.write(_header(0))
+
+    def __contains__(self, path):
+        return path in self.index
+
+    def write(self, path, data):
+        if path in self.index:
+            return
+        self.index[path] = self.f.tell()
+        self.f.write(_member({'path': path, 'data': data}))
+
+    def write_file(self, url, content):
+        self.write(f'file:{url}', base64.b64encode(content).decode())
+
+    def close(self):
+        index_offset = self.f.tell()
+        self.f.write(_member({'index': self.index}))
+        self.f.seek(0)
+        self.f.write(_header(index_offset))
+        self.f.seek(0, 2)
+        self.f.flush()
+
+
+class SnapshotReader:
+
+    def __init__(self, fileobj):
+        self.f = fileobj
+        self._lock = threading.Lock()
+        header = self._read(0)
+        if header.get('format') != FORMAT or header.get('version') != VERSION:
+            raise ValueError('This file is not a supported XING Events snapshot.')
+        self.index = self._read(int(header['index']))['index']
+
+    def _read(self, offset):
+        with self._lock:
+            self.f.seek(offset)
+            with gzip.GzipFile(fileobj=self.f, mode='rb') as g:
+                return json.loads(g.readline())
+
+    def __contains__(self, path):
+        return path in self.index
+
+    def get(self, path):
+        return self._read(self.index[path])['data']
+
+    def close(self):
+        self.f.close()
+
+
+class XINGEventsSnapshotSource(XINGEventsAPIClient):
+    """
+    Serves the same requests as the API client, but from a snapshot file.
+    """
+    streaming = False
+
+    def __init__(self, filename):
+        super().__init__(apikey=None)
+        self.reader = SnapshotReader(open(filename, 'rb'))
+
+    def _get(self, path, **kwargs):
+        if path not in self.reader:
+            raise APIError(f'{path} is not contained in the snapshot')
+        self.request_count += 1
+        return self.reader.get(path)
+
+    def get_file(self, url):
+        path = f'file:{url}'
+        if path not in self.reader:
+            raise APIError(f'{url} is not contained in the snapshot')
+        return base64.b64decode(self.reader.get(path))
+
+    def close(self):
+        self.reader.close()
+
+
+class SnapshotExporter:
+    """
+    Fetches everything the importer would fetch for the given events and writes it to a snapshot.
+    """
+
+    def __init__(self, client, writer):
+        self.client = client
+        self.writer = writer
+
+    def _get(self, path):
+        d = self.client._get(path)
+        self.writer.write(path, d)
+        return d
+
+    def _file(self, url):
+        if url and f'file:{url}' not in self.writer:
+            self.writer.write_file(url, self.client.get_file(url))
+
+    def export(self, event_ids=None):
+        d = self.client._get('event/find')
+        if event_ids:
+            # The snapshot must only list the events it contains, otherwise importing all of its events fails
+            d = {**d, 'ids': list(event_ids)}
+        self.writer.write('event/find', d)
+        for event_id in d['ids']:
+            self.export_event(event_id)
+
+    def export_event(self, event_id):
+        d = self._get(f'event/{event_id}')['event']
+        ts = self._get(f'event/{event_id}/ticketShop')['ticketShop']
+        self._file(d.get('banner'))
+        self._file(d.get('logo'))
+        for url in (ts.get('ownTermsAndConditions'), ts.get('ownPrivacyPolicy')):
+            if url and 'xing-events.com/' in url:
+                self._file(url)
+
+        for category_id in self._get(f'event/{event_id}/ticketCategories')['ticketCategories']:
+            self._get(f'ticketCategory/{category_id}')
+        for pd_id in self._get(f'event/{event_id}/productDefinitions')['productDefinitions']:
+            self._get(f'productDefinition/{pd_id}')
+        self._get(f'event/{event_id}/userData')
+
+        for code_def_id in self._get(f'event/{event_id}/codeDefinitions')['codeDefinitions']:
+            self._get(f'codeDefinition/{code_def_id}')
+            page_num = 0
+            while True:
+                r_codes = self._get(f'codeDefinition/{code_def_id}/codes?page={page_num}')
+                if r_codes['currentPage'] == r_codes['lastPage']:
+                    break
+                page_num += 1
+
+        for payment_id in self._get(f'event/{event_id}/payments')['payments']:
+            self.export_payment(payment_id)
+
+    def export_payment(self, payment_id):
+        payment = self._get(f'payment/{payment_id}')['payment']
+        self._get(f'payment/{payment_id}/products')
+        self._files_from_userdata(payment.get('userData', []))
+        for ticket_id in self._get(f'payment/{payment_id}/tickets')['tickets']:
+            ticket = self._get(f'ticket/{ticket_id}')['ticket']
+            self._get(f'ticket/{ticket["id"]}/products')
+            if f'participant/{ticket["participantId"]}' not in self.writer:
+                self._get(f'participant/{ticket["participantId"]}')
+            self._files_from_userdata(ticket.get('userData', []))
+
+    def _files_from_userdata(self, userdata):
+        for ud in userdata:
+            if ud['type'] in ('photo', 'file') and ud.get('value'):
+                self._file(ud['value'])
@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+
+# Number of API request chains running at the same time while the structure of an event is fetched
+STAGE_WORKERS = 6
+
+
+class StageScheduler:
+    """
+    Runs the fetch functions of all stages of an import concurrently as soon as it is entered. The importer then
+    waits for the result of each stage right before it writes it to the database, so the writes still happen in
+    dependency order while the API requests of later stages are already in flight::
+
+        with StageScheduler() as stages:
+            stages.add('event', lambda: fetch_event(event_id))
+            stages.add('categories', lambda: fetch_categories(event_id))
+            event = write_event(stages.result('event'))
+            write_categories(event, stages.result('categories'))
+
+    Fetch functions run in threads and must not access the database.
+    """
+
+    def __init__(self, max_workers=STAGE_WORKERS):
+        self.max_workers = max_workers
+        self._executor = None
+        self._futures = {}
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='xing-stage')
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # If a write failed, there is no point in waiting for requests that have not been sent yet
+        self._executor.shutdown(wait=True, cancel_futures=exc_type is not None)
+        self._executor = None
+
+    def _run(self, fetch):
+        try:
+            return fetch()
+        finally:
+            # The validator store might be backed by the database cache
+            connections.close_all()
+
+    def add(self, name, fetch):
+        if name in self._futures:
+            raise ValueError(f'Stage {name} has already been added.')
+        self._futures[name] = self._executor.submit(self._run, fetch)
+
+    def result(self, name):
+        """
+        Waits for the fetch function of a stage and returns its result or raises its exception.
+        """
+        return self._futures[name].result()
@@ -0,0 +1,38 @@
+from django.core.cache import cache
+
+# Re-imports usually happen within days or weeks of each other
+VALIDATOR_TIMEOUT = 3600 * 24 * 60
+
+
+class DictValidatorStore:
+    """
+    Keeps the validators (ETag, Last-Modified) and payloads of responses in memory, mostly useful for tests.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, url):
+        return self.data.get(url)
+
+    def set(self, url, value):
+        self.data[url] = value
+
+
+class CacheValidatorStore:
+    """
+    Keeps the validators and payloads of responses in the pretix cache, so re-imports can send conditional requests.
+    The payload is stored as well since a ``304 Not Modified`` response does not contain one.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def _key(self, url):
+        return f'{self.prefix}:{url}'
+
+    def get(self, url):
+        return cache.get(self._key(url))
+
+    def set(self, url, value):
+        cache.set(self._key(url), value, VALIDATOR_TIMEOUT)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from ...importer.client import XINGEventsAPIClient
+from ...importer.snapshot import SnapshotExporter, SnapshotWriter
+
+
+class Command(BaseCommand):
+    help = 'Exports all data of a XING Events account into a snapshot file that can be imported later'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apikey', type=str, help='API Key', required=True)
+        parser.add_argument('--output', type=str, help='Snapshot file to write', required=True)
+        parser.add_argument('--event', type=int, action='append', help='Only export this XING event ID')
+
+    def handle(self, *args, **options):
+        client = XINGEventsAPIClient(apikey=options['apikey'])
+        with open(options['output'], 'wb') as f:
+            writer = SnapshotWriter(f)
+            SnapshotExporter(client, writer).export(options['event'])
+            writer.close()
+        self.stdout.write(f'Exported {len(writer.index)} records with {client.request_count} API calls.')
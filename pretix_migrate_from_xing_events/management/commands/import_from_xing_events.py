@@ -1,8 +1,45 @@
-from django.core.management.base import BaseCommand
-from django_scopes import scope
+import json
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django_scopes import scope, scopes_disabled
 
 from pretix.base.models import Organizer
+from ...importer.batch import ManifestError, read_manifest, run_batch
+from ...importer.locks import COMMAND_LEASE_PREFIX, release_lease
 from ...importer.main import XINGEventsImporter
+from ...importer.shards import PaymentImportResult, split_into_shards
+from ...importer.snapshot import XINGEventsSnapshotSource
+from ...tasks import lease_renewer, reserve_events
+
+
+def _importer(organizer, apikey, snapshot):
+    return XINGEventsImporter(
+        apikey=apikey,
+        organizer=organizer,
+        client=XINGEventsSnapshotSource(snapshot) if snapshot else None,
+    )
+
+
+# Seconds between checks whether another import of the same event is done
+LEASE_POLL_SECONDS = 10
+
+
+def _import_shard(organizer_pk, apikey, snapshot, event_pk, payment_ids, xing_event, owner):
+    with scopes_disabled():
+        organizer = Organizer.objects.get(pk=organizer_pk)
+    with scope(organizer=organizer):
+        importer = _importer(organizer, apikey, snapshot)
+        try:
+            event = organizer.events.get(pk=event_pk)
+            return importer.import_payment_shard(
+                event, payment_ids, progress_callback=lease_renewer(organizer, [xing_event], owner)
+            ).as_dict()
+        finally:
+            importer.client.close()
 
 
 class Command(BaseCommand):
@@ -11,6 +48,24 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--organizer', type=str, help='Organizer slug')
         parser.add_argument('--apikey', type=str, help='API Key')
+        parser.add_argument('--snapshot', type=str,
+                            help='Import from a snapshot file created with export_xing_events_snapshot instead of the API')
+        parser.add_argument('--event', type=int, action='append', help='Only import this XING event ID')
+        parser.add_argument('--no-vouchers', action='store_true', help='Do not import promotion codes')
+        parser.add_argument('--no-orders', action='store_true', help='Do not import orders')
+
+        parser.add_argument('--manifest', type=str,
+                            help='Import all organizers listed in this JSON file instead of a single organizer')
+        parser.add_argument('--jobs', type=int, default=1, help='Number of events to import in parallel')
+        parser.add_argument('--per-organizer-jobs', type=int, default=1,
+                            help='Number of events of the same organizer to import in parallel')
+        parser.add_argument('--summary', type=str, help='Write a JSON summary of the batch import to this file')
+
+        parser.add_argument('--plan', action='store_true',
+                            help='Only estimate API calls, rows and duration of the import, do not import anything')
+
+        parser.add_argument('--shards', type=int, default=1,
+                            help='Import the orders of every event in this many parallel processes')
 
         parser.add_argument('--testmode', action='store_true')
         parser.add_argument('--debug', action='store_true')
@@ -19,9 +74,102 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         debug = options['debug']
         verbose = debug or options['verbose']
+        if options['manifest']:
+            return self._batch(options)
+        if not options['organizer']:
+            raise CommandError('Please pass either --organizer or --manifest.')
         organizer = Organizer.objects.get(slug=options['organizer'])
 
         with scope(organizer=organizer):
-            importer = XINGEventsImporter(apikey=options['apikey'], organizer=organizer)
-            for event_id in importer.client.get_event_ids():
-                importer.import_event(event_id)
+            importer = _importer(organizer, options['apikey'], options['snapshot'])
+            try:
+                if options['plan']:
+                    self._plan(importer, options)
+                else:
+                    self._import(importer, options, verbose)
+            finally:
+                importer.client.close()
+
+    def _import(self, importer, options, verbose):
+        organizer = importer.organizer
+        owner = f'{COMMAND_LEASE_PREFIX}{uuid.uuid4().hex}'
+        for event_id in options['event'] or importer.client.get_event_ids():
+            self._wait_for_lease(organizer, event_id, owner)
+            try:
+                if options['shards'] > 1 and not options['no_orders']:
+                    self._import_sharded(importer, options, event_id, owner)
+                else:
+                    event = importer.import_event(
+                        event_id, with_vouchers=not options['no_vouchers'], with_orders=not options['no_orders'],
+                        progress_callback=lease_renewer(organizer, [event_id], owner),
+                    )
+                    if verbose:
+                        self.stdout.write(f'{event_id} {event.slug}: imported')
+            finally:
+                release_lease(organizer, event_id, owner)
+
+    def _wait_for_lease(self, organizer, event_id, owner):
+        # Another import of the same event (a task or another command) is running, we continue once it is done
+        own, running = reserve_events(organizer, [event_id], owner)
+        if running:
+            self.stdout.write(f'{event_id}: waiting for the running import {running[event_id]}')
+        while not own:
+            time.sleep(LEASE_POLL_SECONDS)
+            own, running = reserve_events(organizer, [event_id], owner)
+
+    def _batch(self, options):
+        if options['jobs'] < 1 or options['per_organizer_jobs'] < 1:
+            raise CommandError('--jobs and --per-organizer-jobs need to be at least 1.')
+        try:
+            with open(options['manifest']) as f:
+                entries = read_manifest(f)
+        except ManifestError as e:
+            raise CommandError(str(e))
+
+        def log(r):
+            self.stdout.write(f'{r["organizer"]} {r["event_id"]}: {r["outcome"]} ({r.get("duration", 0):.1f}s)')
+            if r['outcome'] != 'success' and options['debug']:
+                self.stderr.write(r.get('traceback') or r['error'])
+
+        summary = run_batch(entries, jobs=options['jobs'], per_organizer_jobs=options['per_organizer_jobs'], log=log)
+        if options['summary']:
+            with open(options['summary'], 'w') as f:
+                json.dump(summary, f, indent=2)
+        self.stdout.write(f'Done in {summary["duration"]:.0f}s: {summary["outcomes"]}')
+
+    def _import_sharded(self, importer, options, event_id, owner):
+        shards = options['shards']
+        event = importer.import_event_structure(event_id, with_vouchers=not options['no_vouchers'])
+        payment_ids = importer.get_payment_ids(event_id)
+
+        # Forked processes must not share our database connection
+        connections.close_all()
+        result = PaymentImportResult()
+        with ProcessPoolExecutor(max_workers=shards) as executor:
+            futures = [
+                executor.submit(
+                    _import_shard, importer.organizer.pk, options['apikey'], options['snapshot'], event.pk, shard,
+                    event_id, owner,
+                )
+                for shard in split_into_shards(payment_ids, shards)
+            ]
+            for f in futures:
+                result.merge(PaymentImportResult.from_dict(f.result()))
+        importer.refresh_quota_availability(event)
+        self.stdout.write(f'{event_id} {event.slug}: {result.as_dict()}')
+
+    def _plan(self, importer, options):
+        total_calls = total_rows = total_duration = 0
+        for event_id in options['event'] or importer.client.get_event_ids():
+            plan = importer.plan_event(
+                event_id, with_vouchers=not options['no_vouchers'], with_orders=not options['no_orders']
+            )
+            self.stdout.write(
+                f'{event_id} {plan.title}: {plan.payments} payments, {plan.tickets} tickets, {plan.codes} codes, '
+                f'{plan.api_calls} API calls, {plan.rows} rows, ~{plan.estimated_minutes} min '
+                f'(latency {plan.latency * 1000:.0f} ms)'
+            )
+            total_calls += plan.api_calls
+            total_rows += plan.rows
+            total_duration += plan.estimated_duration
+        self.stdout.write(f'Total: {total_calls} API calls, {total_rows} rows, ~{total_duration / 60:.0f} min')
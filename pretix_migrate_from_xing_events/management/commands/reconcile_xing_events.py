@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django_scopes import scope
+
+from pretix.base.models import Organizer
+from ...importer.client import XINGEventsAPIClient
+from ...importer.reconcile import reconcile_event
+
+
+class Command(BaseCommand):
+    help = 'Compares the totals of imported events with the totals of XING Events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organizer', type=str, help='Organizer slug', required=True)
+        parser.add_argument('--apikey', type=str, help='API Key, defaults to the one stored for the organizer')
+        parser.add_argument('--event', type=int, action='append', help='Only compare this XING event ID')
+        parser.add_argument('--json', type=str, help='Write the full report as JSON to this file')
+
+    def handle(self, *args, **options):
+        organizer = Organizer.objects.get(slug=options['organizer'])
+        with scope(organizer=organizer):
+            apikey = options['apikey'] or organizer.settings.pretix_migrate_from_xing_events_apikey
+            if not apikey:
+                raise CommandError('Please pass --apikey.')
+            client = XINGEventsAPIClient(apikey=apikey)
+
+            report = []
+            for event_id in options['event'] or client.get_event_ids():
+                r = reconcile_event(client, organizer, event_id)
+                report.append(r.as_dict())
+                if r.slug is None:
+                    self.stdout.write(f'{event_id} {r.title}: not imported')
+                    continue
+                self.stdout.write(f'{event_id} {r.slug}: {"ok" if r.ok else "differences found"}')
+                for name, xing, pretix in r.differences:
+                    self.stdout.write(f'  {name}: XING {xing}, pretix {pretix}')
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(report, f, indent=2)
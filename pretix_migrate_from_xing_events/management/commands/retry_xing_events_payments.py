@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django_scopes import scope
+
+from pretix.base.models import Organizer
+from ...importer.main import XINGEventsImporter
+from ...models import FailedPayment
+
+
+class Command(BaseCommand):
+    help = 'Imports XING payments again that could not be imported before'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organizer', type=str, help='Organizer slug', required=True)
+        parser.add_argument('--apikey', type=str, help='API Key, defaults to the one stored for the organizer')
+        parser.add_argument('--event', type=str, action='append', help='Only retry payments of this event slug')
+        parser.add_argument('--from-payload', action='store_true',
+                            help='Import the payloads stored with the failure instead of fetching them again')
+
+    def handle(self, *args, **options):
+        organizer = Organizer.objects.get(slug=options['organizer'])
+        with scope(organizer=organizer):
+            apikey = options['apikey'] or organizer.settings.pretix_migrate_from_xing_events_apikey
+            if not apikey and not options['from_payload']:
+                raise CommandError('Please pass --apikey or --from-payload.')
+            importer = XINGEventsImporter(apikey=apikey, organizer=organizer)
+
+            events = organizer.events.filter(
+                pk__in=FailedPayment.objects.filter(organizer=organizer).values('event')
+            )
+            if options['event']:
+                events = events.filter(slug__in=options['event'])
+            for event in events:
+                result = importer.retry_failed_payments(event, from_payload=options['from_payload'])
+                self.stdout.write(f'{event.slug}: {result.as_dict()}')
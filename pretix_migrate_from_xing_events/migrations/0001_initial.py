@@ -0,0 +1,35 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('pretixbase', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FailedPayment',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('payment_id', models.BigIntegerField()),
+                ('payload', models.JSONField(null=True)),
+                ('error', models.TextField()),
+                ('traceback', models.TextField()),
+                ('attempts', models.PositiveIntegerField(default=1)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('last_attempt', models.DateTimeField(auto_now=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                            related_name='xing_failed_payments', to='pretixbase.event')),
+                ('organizer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                related_name='xing_failed_payments', to='pretixbase.organizer')),
+            ],
+            options={
+                'ordering': ('event', 'payment_id'),
+                'unique_together': {('organizer', 'payment_id')},
+            },
+        ),
+    ]
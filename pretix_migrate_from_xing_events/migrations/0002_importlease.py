@@ -0,0 +1,27 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pretixbase', '0001_initial'),
+        ('pretix_migrate_from_xing_events', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportLease',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('event_id', models.BigIntegerField()),
+                ('owner', models.CharField(max_length=190)),
+                ('expires', models.DateTimeField()),
+                ('organizer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                related_name='xing_import_leases', to='pretixbase.organizer')),
+            ],
+            options={
+                'unique_together': {('organizer', 'event_id')},
+            },
+        ),
+    ]
@@ -1 +1,45 @@
 from django.db import models
+from django_scopes import ScopedManager
+
+
+class FailedPayment(models.Model):
+    """
+    A XING payment that could not be imported. The rest of the import continues without it, and it can be retried
+    with the ``retry_xing_events_payments`` command.
+    """
+    id = models.BigAutoField(primary_key=True)
+    organizer = models.ForeignKey('pretixbase.Organizer', on_delete=models.CASCADE,
+                                  related_name='xing_failed_payments')
+    event = models.ForeignKey('pretixbase.Event', on_delete=models.CASCADE, related_name='xing_failed_payments')
+    payment_id = models.BigIntegerField()
+    payload = models.JSONField(null=True)
+    error = models.TextField()
+    traceback = models.TextField()
+    attempts = models.PositiveIntegerField(default=1)
+    created = models.DateTimeField(auto_now_add=True)
+    last_attempt = models.DateTimeField(auto_now=True)
+
+    objects = ScopedManager(organizer='organizer')
+
+    class Meta:
+        unique_together = (('organizer', 'payment_id'),)
+        ordering = ('event', 'payment_id')
+
+
+class ImportLease(models.Model):
+    """
+    Reservation of the import of a XING event, see ``importer.locks``. Only used if the cache does not store values,
+    leases are kept in the cache otherwise.
+    """
+    id = models.BigAutoField(primary_key=True)
+    organizer = models.ForeignKey('pretixbase.Organizer', on_delete=models.CASCADE,
+                                  related_name='xing_import_leases')
+    event_id = models.BigIntegerField()
+    owner = models.CharField(max_length=190)
+    expires = models.DateTimeField()
+
+    # Leases are taken before an organizer's scope is activated, e.g. in batch runs
+    objects = models.Manager()
+
+    class Meta:
+        unique_together = (('organizer', 'event_id'),)
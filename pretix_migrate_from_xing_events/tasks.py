@@ -1,17 +1,263 @@
+import logging
+from contextlib import contextmanager
+
+from celery import chord
+from celery.exceptions import Ignore, Retry
+from celery.result import AsyncResult
+from django.conf import settings
+from django.core.cache import cache
+
+from pretix.base.models import Event
 from pretix.base.services.orderimport import DataImportError
 from pretix.base.services.tasks import OrganizerUserTask
 from pretix.celery_app import app
-from pretix_migrate_from_xing_events.importer.main import XINGEventsImporter
+from pretix_migrate_from_xing_events.importer.locks import acquire_lease, cache_holds_values, release_lease, renew_lease
+from pretix_migrate_from_xing_events.importer.shards import PaymentImportResult, split_into_shards, SHARD_MIN_PAYMENTS
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_TIMEOUT = 3600 * 24
+
+# Migrations can run for hours, so large installations should route them to workers of their own, e.g.
+#
+#   [pretix_migrate_from_xing_events]
+#   queue=xing
+#   soft_time_limit=3300
+#   time_limit=3600
+#   organizer_concurrency=2
+#
+# The time limits apply to every single task, i.e. to one event or one shard of payments, not the whole migration.
+CONFIG_SECTION = 'pretix_migrate_from_xing_events'
+QUEUE = settings.CONFIG_FILE.get(CONFIG_SECTION, 'queue', fallback=None) or None
+SOFT_TIME_LIMIT = settings.CONFIG_FILE.getint(CONFIG_SECTION, 'soft_time_limit', fallback=0) or None
+TIME_LIMIT = settings.CONFIG_FILE.getint(CONFIG_SECTION, 'time_limit', fallback=0) or None
+# Number of migration tasks of the same organizer that may run at the same time, 0 for no limit
+ORGANIZER_CONCURRENCY = settings.CONFIG_FILE.getint(CONFIG_SECTION, 'organizer_concurrency', fallback=0)
+# Seconds after which a task that exceeded the organizer's share is tried again
+REQUEUE_COUNTDOWN = 30
+# Attempts to take a slot of the organizer's share before the task is tried again later
+SHARE_ATTEMPTS = 5
+# Shards go back to the end of the queue after this many payments, so they share the workers with other tasks
+REQUEUE_PAYMENTS = 1000
+
+TASK_OPTIONS = dict(
+    base=OrganizerUserTask, throws=(DataImportError, ImportError,), bind=True, queue=QUEUE,
+    soft_time_limit=SOFT_TIME_LIMIT, time_limit=TIME_LIMIT,
+)
+
+
+def progress_keys(taskid):
+    return f'xing_import_progress_{taskid}_done', f'xing_import_progress_{taskid}_total'
+
+
+def get_progress(taskid):
+    done_key, total_key = progress_keys(taskid)
+    total = cache.get(total_key)
+    if not total:
+        return None
+    return min(100, int(100 * (cache.get(done_key) or 0) / total))
 
 
-@app.task(base=OrganizerUserTask, throws=(DataImportError, ImportError,), bind=True)
-def import_from_xing(self, organizer, events, with_vouchers, with_orders, user):
-    importer = XINGEventsImporter(
+@contextmanager
+def organizer_share(task, organizer):
+    """
+    Runs the body only if the organizer does not already occupy its share of the workers, otherwise puts the task
+    back into the queue, so a single organizer's migration can not block everybody else's. Without a cache that
+    stores the number of running tasks, there is no limit.
+    """
+    if not ORGANIZER_CONCURRENCY or not cache_holds_values():
+        yield
+        return
+    key = f'xing_import_running_{organizer.pk}'
+    # Expires eventually in case a worker dies without releasing its slot. No task runs longer than that, so the
+    # expiry is pushed back whenever a task starts and the counter only expires once all tasks are gone.
+    timeout = TIME_LIMIT or PROGRESS_TIMEOUT
+    for __ in range(SHARE_ATTEMPTS):
+        cache.add(key, 0, timeout)
+        try:
+            running = cache.incr(key)
+            break
+        except ValueError:
+            # The counter expired between add() and incr()
+            pass
+    else:
+        raise task.retry(countdown=REQUEUE_COUNTDOWN, max_retries=None)
+    cache.touch(key, timeout)
+    if running > ORGANIZER_CONCURRENCY:
+        cache.decr(key)
+        raise task.retry(countdown=REQUEUE_COUNTDOWN, max_retries=None)
+    try:
+        yield
+    finally:
+        try:
+            cache.decr(key)
+        except ValueError:
+            pass
+
+
+def reserve_events(organizer, events, taskid):
+    """
+    Acquires the leases of the given XING events for a new task. Returns the events the new task should import and
+    the IDs of the tasks that are already importing the others.
+    """
+    own, running = [], {}
+    for event_id in events:
+        holder = acquire_lease(organizer, event_id, taskid)
+        if holder != taskid and AsyncResult(holder).ready():
+            # The task is over, but could not release its lease, e.g. because one of its shards failed
+            release_lease(organizer, event_id, holder)
+            holder = acquire_lease(organizer, event_id, taskid)
+        if holder == taskid:
+            own.append(event_id)
+        else:
+            running[event_id] = holder
+    return own, running
+
+
+def lease_renewer(organizer, events, owner):
+    """
+    Returns a progress callback that keeps the leases of the given XING events while an import makes progress.
+    """
+    def renew(num=0):
+        for event_id in events:
+            if not renew_lease(organizer, event_id, owner):
+                logger.warning(f'The lease of XING event {event_id} was acquired by another import.')
+
+    return renew
+
+
+def _importer(organizer):
+    # The importer pulls in a lot of dependencies, web processes and workers should only pay for them once a
+    # migration actually runs.
+    from pretix_migrate_from_xing_events.importer.main import XINGEventsImporter
+
+    return XINGEventsImporter(
         apikey=organizer.settings.pretix_migrate_from_xing_events_apikey,
         organizer=organizer,
     )
-    slugs = []
+
+
+@app.task(**TASK_OPTIONS)
+def import_from_xing(self, organizer, events, with_vouchers, with_orders, user, shards=1, slugs=None):
+    try:
+        with organizer_share(self, organizer):
+            return _import_from_xing(self, organizer, events, with_vouchers, with_orders, user, shards, slugs)
+    except (Ignore, Retry):
+        # The import continues in another task
+        raise
+    except Exception:
+        for event_id in events:
+            release_lease(organizer, event_id, self.request.id)
+        raise
+
+
+def _import_from_xing(self, organizer, events, with_vouchers, with_orders, user, shards, slugs):
+    importer = _importer(organizer)
+    slugs = list(slugs or [])
+    renew = lease_renewer(organizer, events, self.request.id)
     for i, event_id in enumerate(events):
-        e = importer.import_event(int(event_id), with_vouchers=with_vouchers, with_orders=with_orders)
-        slugs.append(e.slug)
+        if i > 0:
+            # Go back to the end of the queue after every event, so long migrations share the workers with other
+            # tasks. The replacement inherits our task ID, so the status page keeps working.
+            raise self.replace(import_from_xing.s(
+                organizer=organizer.pk, events=events[i:], with_vouchers=with_vouchers, with_orders=with_orders,
+                user=user.pk if user else None, shards=shards, slugs=slugs,
+            ))
+
+        if not with_orders or shards <= 1:
+            e = importer.import_event(
+                int(event_id), with_vouchers=with_vouchers, with_orders=with_orders, progress_callback=renew,
+            )
+            slugs.append(e.slug)
+            release_lease(organizer, event_id, self.request.id)
+            continue
+
+        e = importer.import_event_structure(int(event_id), with_vouchers=with_vouchers)
+        payment_ids = importer.get_payment_ids(int(event_id))
+        if len(payment_ids) < SHARD_MIN_PAYMENTS:
+            importer.import_payment_shard(e, payment_ids, progress_callback=renew)
+            importer.refresh_quota_availability(e)
+            slugs.append(e.slug)
+            release_lease(organizer, event_id, self.request.id)
+            continue
+
+        # Import the payments in parallel and continue with the remaining events once all shards are done.
+        # The replacement inherits our task ID, so the status page keeps working.
+        done_key, total_key = progress_keys(self.request.id)
+        cache.set(done_key, 0, PROGRESS_TIMEOUT)
+        cache.set(total_key, len(payment_ids), PROGRESS_TIMEOUT)
+        renew()
+        header = [
+            import_from_xing_shard.s(
+                organizer=organizer.pk, event=e.pk, payment_ids=shard, user=user.pk if user else None,
+                progress_taskid=self.request.id, xing_events=events[i:],
+            )
+            for shard in split_into_shards(payment_ids, shards)
+        ]
+        callback = import_from_xing_merge.s(
+            organizer=organizer.pk, events=events[i + 1:], with_vouchers=with_vouchers, with_orders=with_orders,
+            user=user.pk if user else None, shards=shards, slugs=slugs + [e.slug], event=e.pk,
+            xing_event=event_id,
+        )
+        raise self.replace(chord(header, callback))
+    return slugs
+
+
+@app.task(**TASK_OPTIONS)
+def import_from_xing_shard(self, organizer, event, payment_ids, user=None, progress_taskid=None, xing_events=None,
+                           previous=None):
+    with organizer_share(self, organizer):
+        result = _import_from_xing_shard(organizer, event, payment_ids[:REQUEUE_PAYMENTS], progress_taskid, xing_events)
+    if previous:
+        result.merge(PaymentImportResult.from_dict(previous))
+
+    if len(payment_ids) > REQUEUE_PAYMENTS:
+        # Every batch is committed already, so we can continue with the rest at the end of the queue. The
+        # replacement inherits our task ID, so the chord waits for it.
+        raise self.replace(import_from_xing_shard.s(
+            organizer=organizer.pk, event=event, payment_ids=payment_ids[REQUEUE_PAYMENTS:],
+            user=user.pk if user else None, progress_taskid=progress_taskid, xing_events=xing_events, previous=result.as_dict(),
+        ))
+    return result.as_dict()
+
+
+def _import_from_xing_shard(organizer, event, payment_ids, progress_taskid, xing_events):
+    event = organizer.events.get(pk=event)
+    # The leases belong to the task that started the shards, which is waiting for us
+    renew = lease_renewer(organizer, xing_events or [], progress_taskid)
+
+    def progress(num):
+        if progress_taskid:
+            try:
+                cache.incr(progress_keys(progress_taskid)[0], num)
+            except ValueError:
+                pass
+            renew()
+
+    return _importer(organizer).import_payment_shard(event, payment_ids, progress_callback=progress)
+
+
+@app.task(**TASK_OPTIONS)
+def import_from_xing_merge(self, shard_results, organizer, events, with_vouchers, with_orders, user, shards, slugs, event,
+                           xing_event=None):
+    result = PaymentImportResult()
+    for r in shard_results:
+        result.merge(PaymentImportResult.from_dict(r))
+    try:
+        event = organizer.events.get(pk=event)
+        event.log_action('pretix_migrate_from_xing_events.imported', user=user, data=result.as_dict())
+        _importer(organizer).refresh_quota_availability(event)
+    except Event.DoesNotExist:
+        pass
+    logger.info(f'Imported payments of XING event in {len(shard_results)} shards: {result.as_dict()}')
+    # The chord callback inherits the task ID of the import that started the shards
+    release_lease(organizer, xing_event, self.request.id)
+    lease_renewer(organizer, events, self.request.id)()
+
+    if events:
+        raise self.replace(import_from_xing.s(
+            organizer=organizer.pk, events=events, with_vouchers=with_vouchers, with_orders=with_orders,
+            user=user.pk if user else None, shards=shards, slugs=slugs,
+        ))
     return slugs
+
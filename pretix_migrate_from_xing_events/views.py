@@ -3,8 +3,10 @@ from urllib.parse import quote, urljoin
 
 import requests
 from celery.result import AsyncResult
+from celery.utils import uuid
 from dateutil.parser import parse
 from django import forms
+from django.conf import settings
 from django.contrib import messages
 from django.core.exceptions import ValidationError
 from django.db import transaction
@@ -18,10 +20,16 @@ from pretix.base.forms import SettingsForm, SecretKeySettingsField, SECRET_REDAC
 from pretix.control.permissions import OrganizerPermissionRequiredMixin
 from pretix.control.views.organizer import OrganizerSettingsFormView
 from pretix_migrate_from_xing_events.importer.client import XINGEventsAPIClient
-from .tasks import import_from_xing
+from pretix_migrate_from_xing_events.importer.locks import COMMAND_LEASE_PREFIX, get_lease, release_lease
+from .tasks import get_progress, import_from_xing, reserve_events
 
 logger = logging.getLogger(__name__)
 
+# Estimates are computed within the web request, so they are limited to a few events with a smaller sample of
+# payments each. The import_from_xing_events command estimates any number of events with --plan.
+PLAN_MAX_EVENTS = 5
+PLAN_SAMPLE_SIZE = 3
+
 
 class ApiSettingsForm(SettingsForm):
     pretix_migrate_from_xing_events_email = forms.EmailField(
@@ -143,26 +151,97 @@ class SelectionView(OrganizerPermissionRequiredMixin, TemplateView):
         with_vouchers = request.POST.get("import-codes") == "on"
         with_orders = request.POST.get("import-orders") == "on"
 
-        res = import_from_xing.apply_async(
-            kwargs={
-                'organizer': request.organizer.pk,
-                'events': events,
-                'with_vouchers': with_vouchers,
-                'with_orders': with_orders,
-                'user': request.user.pk,
-            }
-        )
+        if not events:
+            messages.error(request, _('Please select at least one event.'))
+            return redirect(reverse(
+                'plugins:pretix_migrate_from_xing_events:selection',
+                kwargs={'organizer': self.request.organizer.slug}
+            ))
+
+        if request.POST.get("action") == "plan":
+            return self.render_to_response(self.get_context_data(
+                plans=self._plan(events, with_vouchers, with_orders),
+                selected_events=[int(e) for e in events],
+            ))
+
+        # Events that are already being imported are not imported a second time, e.g. after a double click
+        taskid = uuid()
+        events, running = reserve_events(request.organizer, events, taskid)
+        if running:
+            messages.info(request, _('Some of the selected events are already being imported.'))
+        if events:
+            try:
+                import_from_xing.apply_async(
+                    kwargs={
+                        'organizer': request.organizer.pk,
+                        'events': events,
+                        'with_vouchers': with_vouchers,
+                        'with_orders': with_orders,
+                        'user': request.user.pk,
+                        'shards': settings.CONFIG_FILE.getint('pretix_migrate_from_xing_events', 'shards', fallback=1),
+                    },
+                    task_id=taskid,
+                )
+            except Exception:
+                for event_id in events:
+                    release_lease(request.organizer, event_id, taskid)
+                raise
+        else:
+            taskid = next(iter(running.values()))
+            if taskid.startswith(COMMAND_LEASE_PREFIX):
+                return redirect(reverse(
+                    'plugins:pretix_migrate_from_xing_events:selection',
+                    kwargs={'organizer': self.request.organizer.slug}
+                ))
+
         kwargs = {
             'organizer': self.request.organizer.slug,
-            'taskid': res.id
+            'taskid': taskid
         }
         return redirect(reverse('plugins:pretix_migrate_from_xing_events:status', kwargs=kwargs))
 
+    def _plan(self, events, with_vouchers, with_orders):
+        from pretix_migrate_from_xing_events.importer.main import XINGEventsImporter
+
+        importer = XINGEventsImporter(
+            apikey=self.request.organizer.settings.pretix_migrate_from_xing_events_apikey,
+            organizer=self.request.organizer,
+        )
+        if len(events) > PLAN_MAX_EVENTS:
+            messages.warning(
+                self.request,
+                _('We can only estimate the import of {num} events at a time. The estimate below only covers the '
+                  'first {num} of the selected events.').format(num=PLAN_MAX_EVENTS)
+            )
+            events = events[:PLAN_MAX_EVENTS]
+        plans = []
+        try:
+            for event_id in events:
+                plans.append(importer.plan_event(
+                    int(event_id), with_vouchers=with_vouchers, with_orders=with_orders, sample_size=PLAN_SAMPLE_SIZE,
+                ))
+        except IOError as e:
+            logger.exception('Could not reach XING events')
+            messages.error(
+                self.request,
+                _('We were unable to reach XING Events to estimate your import. Error message: {msg}').format(
+                    msg=str(e)
+                )
+            )
+        return plans
+
     def get_context_data(self, **kwargs):
-        return super().get_context_data(
+        ctx = super().get_context_data(
             events=self.events,
             **kwargs
         )
+        if 'plans' in ctx:
+            ctx['plan_total_minutes'] = sum(p.estimated_minutes for p in ctx['plans'])
+        for e in self.events:
+            lease = get_lease(self.request.organizer, e['id'])
+            e['import_running'] = bool(lease) and (lease.startswith(COMMAND_LEASE_PREFIX) or not AsyncResult(lease).ready())
+            e['import_task'] = lease if e['import_running'] and not lease.startswith(COMMAND_LEASE_PREFIX) else None
+        return ctx
 
     @cached_property
     def events(self):
@@ -214,5 +293,6 @@ class StatusView(OrganizerPermissionRequiredMixin, TemplateView):
         return super().get_context_data(
             result=r,
             events=events,
+            progress=get_progress(kwargs['taskid']),
             **kwargs
         )
@@ -1 +1,162 @@
-# put your pytest fixtures here
+import pytest
+from django_scopes import scope
+
+from pretix.base.models import Organizer
+from pretix_migrate_from_xing_events.importer.client import APIError, XINGEventsAPIClient
+
+
+class StubClient(XINGEventsAPIClient):
+    """
+    Serves canned XING Events payloads from memory and counts the requests like the real client.
+    """
+    streaming = False
+
+    def __init__(self, event_id=1):
+        super().__init__(apikey=None)
+        self.event_id = event_id
+        self.payloads = {}
+        self.files = {}
+        self.categories = []
+        self.product_definitions = []
+        self.userdata = []
+        self.code_definitions = []
+        self.payments = []
+        # IDs of different stubs must not collide, since order codes and tickets are unique across events
+        self._next_id = event_id * 100_000
+        self.add_path('event/find', {'ids': [event_id]})
+        self.add_path(f'event/{event_id}', {'event': {
+            'identifier': f'xing{event_id}',
+            'title': f'XING event {event_id}',
+            'language': 'de',
+            'timezone': 'Europe/Berlin',
+            'country': 'DE',
+            'selectedDate': '2030-06-01T18:00:00',
+            'organisatorDisplayName': 'Dummy',
+        }})
+        self.add_path(f'event/{event_id}/ticketShop', {'ticketShop': {
+            'currency': 'EUR',
+            'commercial': False,
+            'ownTermsAndConditions': None,
+            'ownPrivacyPolicy': None,
+            'availableLimit': None,
+        }})
+        self._update_lists()
+
+    def _id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def add_path(self, path, data):
+        self.payloads[path] = {'success': True, **data}
+
+    def _update_lists(self):
+        self.add_path(f'event/{self.event_id}/ticketCategories', {'ticketCategories': self.categories})
+        self.add_path(f'event/{self.event_id}/productDefinitions', {'productDefinitions': self.product_definitions})
+        self.add_path(f'event/{self.event_id}/userData', {'userData': self.userdata})
+        self.add_path(f'event/{self.event_id}/codeDefinitions', {'codeDefinitions': self.code_definitions})
+        self.add_path(f'event/{self.event_id}/payments', {'payments': self.payments})
+
+    def add_category(self, price=1000):
+        category_id = self._id()
+        self.categories.append(category_id)
+        self.add_path(f'ticketCategory/{category_id}', {'ticketCategory': {
+            'name': f'Ticket {category_id}', 'price': price, 'active': True, 'available': 1000, 'sold': 0,
+        }})
+        self._update_lists()
+        return category_id
+
+    def add_product_definition(self):
+        pd_id = self._id()
+        self.product_definitions.append(pd_id)
+        self.add_path(f'productDefinition/{pd_id}', {'productDefinition': {
+            'type': 'TICKET', 'title': f'Product {pd_id}', 'available': 100,
+            'options': [{'productDefinitionOptionName': 'Standard', 'price': 0, 'available': 100}],
+        }})
+        self._update_lists()
+        return pd_id
+
+    def add_userdata(self, type='string'):
+        field_id = self._id()
+        self.userdata.append({
+            'fieldId': field_id, 'type': type, 'title': f'Question {field_id}', 'required': False, 'orderNumber': 1,
+        })
+        self._update_lists()
+        return field_id
+
+    def add_code_definition(self, category_id, codes, page_size=100):
+        code_def_id = self._id()
+        self.code_definitions.append(code_def_id)
+        self.add_path(f'codeDefinition/{code_def_id}', {'codeDefinition': {
+            'name': f'Codes {code_def_id}', 'type': 'DISCOUNTCODE_TYPE_PERCENT', 'value': 10,
+            'categories': [category_id], 'validCount': 1,
+        }})
+        pages = [list(range(i, min(i + page_size, codes))) for i in range(0, codes, page_size)] or [[]]
+        for page_num, page in enumerate(pages):
+            self.add_path(f'codeDefinition/{code_def_id}/codes?page={page_num}', {
+                'codes': [{'code': f'C{code_def_id}X{i}', 'used': i % 2} for i in page],
+                'currentPage': page_num,
+                'lastPage': len(pages) - 1,
+            })
+        self._update_lists()
+        return code_def_id
+
+    def add_payment(self, category_id, tickets=1, price=1000, participant_id=None, products=(), userdata=()):
+        payment_id = self._id()
+        self.payments.append(payment_id)
+        self.add_path(f'payment/{payment_id}', {'payment': {
+            'identifier': f'P{payment_id}', 'amount': price * tickets, 'creationTime': '2030-01-01T12:00:00',
+            'doubleOptIn': 'TRUE', 'status': 'paid', 'userData': [],
+        }})
+        self.add_path(f'payment/{payment_id}/products', {'products': []})
+        ticket_ids = []
+        for __ in range(tickets):
+            ticket_id = self._id()
+            pid = participant_id or self._id()
+            ticket_ids.append(ticket_id)
+            self.add_path(f'ticket/{ticket_id}', {'ticket': {
+                'id': ticket_id, 'identifier': f'secret{ticket_id}', 'displayIdentifier': f'T{ticket_id}',
+                'ticketCategoryIds': [category_id], 'participantId': pid, 'originalPrice': price,
+                'discountAmount': 0, 'firstName': 'Jane', 'lastName': 'Doe', 'email': 'jane@example.org',
+                'userData': [{'type': 'string', 'fieldId': field_id, 'value': 'Answer'} for field_id in userdata],
+            }})
+            self.add_path(f'ticket/{ticket_id}/products', {'products': [
+                {'productCategoryId': pd_id, 'productCategoryOptionName': 'Standard', 'checked': False}
+                for pd_id in products
+            ]})
+            self.add_path(f'participant/{pid}', {'participant': {
+                'status': 'com.amiando.participant.status.ok', 'email': 'jane@example.org',
+            }})
+        self.add_path(f'payment/{payment_id}/tickets', {'tickets': ticket_ids})
+        self._update_lists()
+        return payment_id
+
+    def _get(self, path, **kwargs):
+        if path not in self.payloads:
+            raise APIError(f'{path} is not stubbed')
+        with self._lock:
+            self.request_count += 1
+        return self.payloads[path]
+
+    def get_file(self, url):
+        return self.files[url]
+
+
+@pytest.fixture
+def organizer():
+    o = Organizer.objects.create(name='Dummy', slug='dummy')
+    with scope(organizer=o):
+        yield o
+
+
+@pytest.fixture
+def stub_client():
+    return StubClient()
+
+
+@pytest.fixture
+def make_stub_client():
+    """
+    Creates stubs of further XING events, e.g. to compare imports of different sizes.
+    """
+    event_ids = iter(range(2, 1000))
+    return lambda: StubClient(event_id=next(event_ids))
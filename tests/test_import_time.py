@@ -0,0 +1,30 @@
+import json
+import subprocess
+import sys
+
+# Importing the modules every pretix process loads must stay cheap, the importer itself is loaded on demand. The
+# time it takes depends on the machine running the tests, so the number of modules the plugin adds on top of what
+# pretix loads anyway is limited instead: the plugin's own modules, ijson if it is installed, and some slack.
+MODULE_BUDGET = 50
+
+SCRIPT = '''
+import json, os, sys
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pretix.testutils.settings')
+import django
+django.setup()
+before = set(sys.modules)
+import pretix_migrate_from_xing_events.tasks
+import pretix_migrate_from_xing_events.urls
+print(json.dumps({
+    'loaded': [m for m in sys.modules if m.startswith('pretix_migrate_from_xing_events')],
+    'added': sorted(set(sys.modules) - before),
+}))
+'''
+
+
+def test_plugin_startup_does_not_load_importer():
+    r = subprocess.run([sys.executable, '-c', SCRIPT], capture_output=True, check=True, text=True)
+    result = json.loads(r.stdout.strip().splitlines()[-1])
+    assert 'pretix_migrate_from_xing_events.importer.main' not in result['loaded']
+    assert 'pretix_migrate_from_xing_events.importer.reconcile' not in result['loaded']
+    assert len(result['added']) <= MODULE_BUDGET, result['added']
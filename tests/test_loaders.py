@@ -0,0 +1,83 @@
+from decimal import Decimal
+
+import pytest
+from django.db import connection
+from django.utils.timezone import now
+
+from pretix.base.models import Order, OrderPosition, Question, QuestionAnswer, Voucher
+from pretix_migrate_from_xing_events.importer.loaders import BulkLoader, CopyLoader, get_loader
+
+UPDATE_FIELDS = ('redeemed', 'tag', 'value')
+
+postgresql_only = pytest.mark.skipif(connection.vendor != 'postgresql', reason='COPY requires PostgreSQL')
+
+
+@pytest.fixture
+def event(organizer):
+    return organizer.events.create(name='Dummy', slug='dummy', date_from=now())
+
+
+def _rows(event, redeemed, count=50):
+    return [
+        {
+            'event': event, 'code': f'CODE{i}', 'redeemed': redeemed, 'tag': 'Tab\tand\\backslash',
+            'max_usages': 10, 'price_mode': 'percent', 'value': Decimal('0.10'),
+        }
+        for i in range(count)
+    ]
+
+
+def _load_twice(loader, event):
+    loader.load(_rows(event, redeemed=0))
+    loader.load(_rows(event, redeemed=1, count=60))
+    assert event.vouchers.count() == 60
+    assert set(event.vouchers.values_list('redeemed', flat=True)) == {1}
+    v = event.vouchers.get(code='CODE7')
+    assert v.tag == 'Tab\tand\\backslash'
+    assert v.value == Decimal('0.10')
+    assert v.max_usages == 10
+
+
+@pytest.mark.django_db
+def test_bulk_loader_upsert(event):
+    _load_twice(BulkLoader(Voucher, unique_fields=('event', 'code'), update_fields=UPDATE_FIELDS), event)
+
+
+@postgresql_only
+@pytest.mark.django_db
+def test_copy_loader_upsert(event):
+    _load_twice(CopyLoader(Voucher, unique_fields=('event', 'code'), update_fields=UPDATE_FIELDS), event)
+
+
+def _load_answers(loader, event):
+    item = event.items.create(name='Ticket', default_price=Decimal('10.00'))
+    question = event.questions.create(question='Company', type=Question.TYPE_STRING, identifier='xing-1')
+    order = Order.objects.create(event=event, code='ABC12', total=Decimal('20.00'), datetime=now())
+    positions = [
+        OrderPosition.objects.create(order=order, item=item, price=Decimal('10.00'), positionid=i + 1)
+        for i in range(2)
+    ]
+
+    loader.load([
+        {'question': question, 'orderposition': op, 'answer': f'Line\nbreak {i}'} for i, op in enumerate(positions)
+    ])
+    answers = QuestionAnswer.objects.filter(question=question).order_by('orderposition__positionid')
+    assert [a.answer for a in answers] == ['Line\nbreak 0', 'Line\nbreak 1']
+    assert [a.orderposition for a in answers] == positions
+
+
+@pytest.mark.django_db
+def test_bulk_loader_answers(event):
+    _load_answers(BulkLoader(QuestionAnswer), event)
+
+
+@postgresql_only
+@pytest.mark.django_db
+def test_copy_loader_answers(event):
+    _load_answers(CopyLoader(QuestionAnswer), event)
+
+
+@pytest.mark.django_db
+def test_copy_backend_falls_back_to_orm():
+    loader = get_loader(Voucher, backend='copy')
+    assert isinstance(loader, CopyLoader) == (connection.vendor == 'postgresql')
@@ -0,0 +1,33 @@
+import pytest
+
+from pretix_migrate_from_xing_events.importer import locks
+
+
+@pytest.fixture(params=['cache', 'database'])
+def lease_backend(request, settings, monkeypatch):
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    monkeypatch.setattr(locks, 'cache_holds_values', lambda: request.param == 'cache')
+    return request.param
+
+
+@pytest.mark.django_db
+def test_lease_excludes_other_owners(organizer, lease_backend):
+    assert locks.acquire_lease(organizer, 1, 'a') == 'a'
+    assert locks.acquire_lease(organizer, 1, 'b') == 'a'
+    assert locks.acquire_lease(organizer, 2, 'b') == 'b'
+    assert locks.get_lease(organizer, 1) == 'a'
+
+    assert locks.renew_lease(organizer, 1, 'a')
+    assert not locks.renew_lease(organizer, 1, 'b')
+
+    locks.release_lease(organizer, 1, 'b')
+    assert locks.get_lease(organizer, 1) == 'a'
+    locks.release_lease(organizer, 1, 'a')
+    assert locks.get_lease(organizer, 1) is None
+    assert locks.acquire_lease(organizer, 1, 'b') == 'b'
+
+
+@pytest.mark.django_db
+def test_expired_lease_is_taken_over(organizer, lease_backend):
+    assert locks.acquire_lease(organizer, 1, 'a', timeout=-1) == 'a'
+    assert locks.acquire_lease(organizer, 1, 'b') == 'b'
@@ -1,3 +1,26 @@
+import pytest
+
+from pretix.base.models import OrderPosition, QuestionAnswer
+from pretix_migrate_from_xing_events.importer.main import XINGEventsImporter
+from pretix_migrate_from_xing_events.models import FailedPayment
+
+
 def test_empty():
     # put your first tests here
     assert 1 + 1 == 2
+
+
+@pytest.mark.django_db
+def test_import_event_with_orders(organizer, stub_client):
+    category_id = stub_client.add_category()
+    field_id = stub_client.add_userdata()
+    for __ in range(3):
+        stub_client.add_payment(category_id, tickets=2, userdata=[field_id])
+    importer = XINGEventsImporter(apikey=None, organizer=organizer, client=stub_client)
+
+    event = importer.import_event(stub_client.event_id, with_vouchers=True, with_orders=True)
+
+    assert event.orders.count() == 3
+    assert OrderPosition.objects.filter(order__event=event).count() == 6
+    assert QuestionAnswer.objects.filter(orderposition__order__event=event).count() == 6
+    assert not FailedPayment.objects.filter(event=event).exists()
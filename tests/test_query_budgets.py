@@ -0,0 +1,179 @@
+"""
+Number of SQL queries and API calls of every import stage as a function of the payload size. The cost of a single
+code, payment or ticket is measured with small imports, must stay below the budgets below and must stay exactly the
+same for larger ones, so a stage that suddenly needs a query per code more than before, or more queries per payment
+than it used to, fails here even if the small payloads used during development are still fast.
+"""
+import math
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from pretix.base.models import Voucher
+from pretix_migrate_from_xing_events.importer.main import PAYMENT_BATCH_SIZE, XINGEventsImporter
+
+# Measured with pretix 2024.2: a payment with one ticket takes 25 queries, i.e. the order and its updates, the
+# position, its add-on and their lookups, the invoice address, transactions, the payment, and the savepoint and
+# its release that isolate every payment from the others in its batch
+PAYMENT_QUERIES = 25
+# Every further ticket of a payment adds its position, its add-on and their item lookups
+TICKET_QUERIES = 12
+# Every batch looks up existing orders and pseudonymization IDs, writes the answers and clears dead letters
+BATCH_QUERIES = 10
+
+# Upper bounds for an event with a single category, product and question, i.e. event settings and meta data,
+# quotas and add-on assignments, and for every further category, product and question
+STRUCTURE_QUERIES = 150
+CATEGORY_QUERIES = 13
+PRODUCT_DEFINITION_QUERIES = 10
+USERDATA_FIELD_QUERIES = 8
+
+
+def structure_api_budget(categories, product_definitions):
+    # event, ticketShop, three lists and one detail call per category and product
+    return 5 + categories + product_definitions
+
+
+def code_api_budget(code_definitions, pages):
+    return 1 + code_definitions + pages
+
+
+def payment_api_budget(payments, tickets, participants):
+    # the list, then payment, payment products and payment tickets per payment, ticket and its products per ticket
+    return 1 + 3 * payments + 2 * tickets + participants
+
+
+def _importer(organizer, client):
+    return XINGEventsImporter(apikey=None, organizer=organizer, client=client)
+
+
+def _count_queries(fn):
+    with CaptureQueriesContext(connection) as ctx:
+        result = fn()
+    return len(ctx.captured_queries), result
+
+
+def _insert_chunks(model, rows):
+    # Some databases limit the number of query parameters, so bulk inserts are split into chunks
+    fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+    return math.ceil(rows / max(connection.ops.bulk_batch_size(fields, [None] * rows), 1))
+
+
+def _import_structure(organizer, client, categories, product_definitions, userdata_fields):
+    for __ in range(categories):
+        client.add_category()
+    for __ in range(product_definitions):
+        client.add_product_definition()
+    for __ in range(userdata_fields):
+        client.add_userdata()
+    importer = _importer(organizer, client)
+    queries, __ = _count_queries(lambda: importer.import_event_structure(client.event_id, with_vouchers=False))
+    return queries
+
+
+@pytest.mark.django_db
+def test_structure_budget(organizer, make_stub_client):
+    # The first import of an organizer creates objects the others share
+    _import_structure(organizer, make_stub_client(), 1, 1, 1)
+    base = _import_structure(organizer, make_stub_client(), 1, 1, 1)
+    per_category = _import_structure(organizer, make_stub_client(), 2, 1, 1) - base
+    per_product_definition = _import_structure(organizer, make_stub_client(), 1, 2, 1) - base
+    per_userdata_field = _import_structure(organizer, make_stub_client(), 1, 1, 2) - base
+    assert base <= STRUCTURE_QUERIES
+    assert per_category <= CATEGORY_QUERIES
+    assert per_product_definition <= PRODUCT_DEFINITION_QUERIES
+    assert per_userdata_field <= USERDATA_FIELD_QUERIES
+
+    client = make_stub_client()
+    queries = _import_structure(organizer, client, 8, 5, 12)
+    assert queries == base + 7 * per_category + 4 * per_product_definition + 11 * per_userdata_field
+    assert client.request_count <= structure_api_budget(8, 5)
+
+
+def _import_codes(organizer, client, codes, page_size=500):
+    category_id = client.add_category()
+    client.add_code_definition(category_id, codes, page_size=page_size)
+    importer = _importer(organizer, client)
+    event = importer.import_event_structure(client.event_id, with_vouchers=False)
+
+    # The second import updates the existing vouchers
+    counts = []
+    for __ in range(2):
+        client.request_count = 0
+        queries, __ = _count_queries(
+            lambda: importer._import_code_definitions(event, 'de', importer._fetch_code_definitions(client.event_id))
+        )
+        counts.append(queries)
+        assert client.request_count <= code_api_budget(1, math.ceil(codes / page_size))
+    assert event.vouchers.count() == codes
+    return counts
+
+
+@pytest.mark.django_db
+def test_code_definitions_budget(organizer, make_stub_client):
+    # Both imports fit into a single batch, so they must need the same queries apart from insert chunks
+    small = _import_codes(organizer, make_stub_client(), 100)
+    large = _import_codes(organizer, make_stub_client(), 400)
+    chunks = _insert_chunks(Voucher, 400) - _insert_chunks(Voucher, 100)
+    assert large == [q + chunks for q in small]
+
+
+def _import_payments(organizer, client, payments, tickets_per_payment):
+    category_id = client.add_category()
+    pd_id = client.add_product_definition()
+    field_id = client.add_userdata()
+    for __ in range(payments):
+        client.add_payment(category_id, tickets=tickets_per_payment, products=[pd_id], userdata=[field_id])
+    importer = _importer(organizer, client)
+    event = importer.import_event_structure(client.event_id, with_vouchers=False)
+
+    client.request_count = 0
+    queries, result = _count_queries(lambda: importer._import_payments(event, 'de', client.event_id))
+    assert result.orders == payments
+    assert result.failed == 0
+    return queries
+
+
+@pytest.mark.django_db
+def test_payments_budget(organizer, make_stub_client):
+    # The first import of an organizer creates objects the others share
+    _import_payments(organizer, make_stub_client(), 1, 1)
+    base = _import_payments(organizer, make_stub_client(), 1, 1)
+    per_payment = _import_payments(organizer, make_stub_client(), 2, 1) - base
+    per_ticket = _import_payments(organizer, make_stub_client(), 1, 2) - base
+    two_batches = _import_payments(organizer, make_stub_client(), PAYMENT_BATCH_SIZE + 1, 1)
+    per_batch = two_batches - base - PAYMENT_BATCH_SIZE * per_payment
+    assert per_payment <= PAYMENT_QUERIES
+    assert per_ticket <= TICKET_QUERIES
+    assert per_batch <= BATCH_QUERIES
+
+    assert _import_payments(organizer, make_stub_client(), 40, 1) == base + 39 * per_payment
+    assert _import_payments(organizer, make_stub_client(), 40, 3) == base + 39 * per_payment + 80 * per_ticket
+    # Three batches
+    payments = 2 * PAYMENT_BATCH_SIZE + 50
+    assert _import_payments(organizer, make_stub_client(), payments, 1) == (
+        base + (payments - 1) * per_payment + 2 * per_batch
+    )
+
+
+@pytest.mark.django_db
+def test_payments_api_budget(organizer, stub_client):
+    category_id = stub_client.add_category()
+    pd_id = stub_client.add_product_definition()
+    field_id = stub_client.add_userdata()
+    payments, tickets_per_payment = 150, 2
+    for i in range(payments):
+        # Every other payment is made by a returning participant, which must only be fetched once
+        stub_client.add_payment(
+            category_id, tickets=tickets_per_payment, participant_id=1 if i % 2 else None, products=[pd_id],
+            userdata=[field_id],
+        )
+    importer = _importer(organizer, stub_client)
+    event = importer.import_event_structure(stub_client.event_id, with_vouchers=False)
+
+    stub_client.request_count = 0
+    result = importer._import_payments(event, 'de', stub_client.event_id)
+    participants = 1 + math.ceil(payments / 2) * tickets_per_payment
+    assert stub_client.request_count <= payment_api_budget(payments, payments * tickets_per_payment, participants)
+    assert result.orders == payments
@@ -0,0 +1,22 @@
+import pytest
+
+from pretix_migrate_from_xing_events import tasks
+from pretix_migrate_from_xing_events.importer.main import XINGEventsImporter
+
+
+@pytest.mark.django_db
+def test_import_shard_task(organizer, stub_client, monkeypatch):
+    category_id = stub_client.add_category()
+    payment_ids = [stub_client.add_payment(category_id) for __ in range(3)]
+    importer = XINGEventsImporter(apikey=None, organizer=organizer, client=stub_client)
+    event = importer.import_event_structure(stub_client.event_id, with_vouchers=False)
+    monkeypatch.setattr(tasks, '_importer', lambda o: XINGEventsImporter(apikey=None, organizer=o, client=stub_client))
+
+    r = tasks.import_from_xing_shard.apply(kwargs={
+        'organizer': organizer.pk, 'event': event.pk, 'payment_ids': payment_ids, 'user': None,
+        'progress_taskid': 'task', 'xing_events': [stub_client.event_id],
+    })
+
+    assert r.successful()
+    assert r.result['orders'] == 3
+    assert event.orders.count() == 3